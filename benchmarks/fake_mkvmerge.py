@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""A scriptable stand-in for `mkvmerge`, used by the benchmarks to run `subbot` offline.
+
+`-J <file>` replays a recorded identification: `<name of the file>.json`, else `<extension>.json`, from the directory
+in $FAKE_MKVMERGE_RECORDINGS, else a built-in one (a Matroska video with a video, an audio and a subtitle track, or
+SSA/ASS subtitles). A mux prints `#GUI#progress N%` lines as `mkvmerge --gui-mode` does, lasting
+$FAKE_MKVMERGE_LATENCY seconds plus the size of the output divided by $FAKE_MKVMERGE_THROUGHPUT bytes per second, and
+writes an output as large as all its inputs, sparse unless $FAKE_MKVMERGE_SPARSE is 0. If $FAKE_MKVMERGE_LOG is set,
+every invocation appends a JSON line to it, with its mode, its arguments and its start and end times.
+"""
+
+import json
+import os
+from os.path import basename, isfile, join, splitext
+import sys
+import time
+
+LATENCY = float(os.environ.get('FAKE_MKVMERGE_LATENCY', 0.005))
+THROUGHPUT = float(os.environ.get('FAKE_MKVMERGE_THROUGHPUT', 2 * 1024 ** 3))
+SPARSE = os.environ.get('FAKE_MKVMERGE_SPARSE', '1') != '0'
+RECORDINGS = os.environ.get('FAKE_MKVMERGE_RECORDINGS')
+LOG = os.environ.get('FAKE_MKVMERGE_LOG')
+
+VIDEO = {
+    'container': {
+        'properties': {'title': 'Fake'},
+        'recognized': True,
+        'supported': True,
+        'type': 'Matroska',
+    },
+    'tracks': [
+        {'id': 0, 'type': 'video', 'codec': 'AVC/H.264/MPEG-4p10',
+         'properties': {'codec_id': 'V_MPEG4/ISO/AVC', 'default_track': True, 'enabled_track': True,
+                        'forced_track': False, 'language': 'und', 'number': 1}},
+        {'id': 1, 'type': 'audio', 'codec': 'AAC',
+         'properties': {'codec_id': 'A_AAC', 'default_track': True, 'enabled_track': True, 'forced_track': False,
+                        'language': 'jpn', 'number': 2}},
+        {'id': 2, 'type': 'subtitles', 'codec': 'SubStationAlpha',
+         'properties': {'codec_id': 'S_TEXT/ASS', 'default_track': True, 'enabled_track': True,
+                        'forced_track': False, 'language': 'eng', 'number': 3, 'track_name': 'English'}},
+    ],
+}
+
+SUBTITLES = {
+    'container': {
+        'properties': {},
+        'recognized': True,
+        'supported': True,
+        'type': 'SSA/ASS subtitles',
+    },
+    'tracks': [
+        {'id': 0, 'type': 'subtitles', 'codec': 'SubStationAlpha',
+         'properties': {'codec_id': 'S_TEXT/ASS', 'encoding': 'UTF-8', 'language': 'und', 'number': 1,
+                        'text_subtitles': True}},
+    ],
+}
+
+
+def log(mode, start):
+    if LOG:
+        line = json.dumps({'mode': mode, 'pid': os.getpid(), 'argv': sys.argv[1:], 'start': start,
+                           'end': time.time()})
+        # a single write of a line opened in append mode is not interleaved with the other processes
+        with open(LOG, 'a') as file:
+            file.write(line + '\n')
+
+
+def identify(file_path):
+    if RECORDINGS:
+        extension = splitext(file_path)[1].lstrip('.').lower()
+        for name in (basename(file_path) + '.json', extension + '.json'):
+            if isfile(join(RECORDINGS, name)):
+                with open(join(RECORDINGS, name)) as recording:
+                    return recording.read()
+    if file_path.lower().endswith(('.ass', '.ssa')):
+        return json.dumps(SUBTITLES)
+    return json.dumps(VIDEO)
+
+
+def mux(args):
+    output_path = args[args.index('-o') + 1]
+    inputs = [arg for arg in args if arg != output_path and isfile(arg)]
+    size = sum(os.stat(path).st_size for path in inputs)
+
+    duration = LATENCY + size / THROUGHPUT
+    for percentage in range(0, 101):
+        print(f'#GUI#progress {percentage}%', flush=True)
+        if percentage < 100:
+            time.sleep(duration / 100)
+
+    with open(output_path, 'wb') as output:
+        if SPARSE:
+            output.truncate(size)
+        else:
+            chunk = bytes(1024 * 1024)
+            for _ in range(size // len(chunk)):
+                output.write(chunk)
+            output.write(bytes(size % len(chunk)))
+
+
+def main(args):
+    start = time.time()
+    if args[:1] in (['-V'], ['--version']):
+        print('mkvmerge v80.0 (\'Fake\') 64-bit')
+        log('version', start)
+        return 0
+    if args[:1] == ['-J']:
+        print(identify(args[1]))
+        log('identify', start)
+        return 0
+    if '-o' not in args:
+        print('Error: no output file name was given.', file=sys.stderr)
+        return 2
+    mux(args)
+    log('mux', start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,91 @@
+"""Startup benchmark of `subbot` and `subbotf`.
+
+Every module is imported several times in a fresh interpreter with `-X importtime`, alternating with the standard
+modules they cannot do without, the reference. The best cumulative import time of the module over the best time of
+the reference is compared with the baseline committed below, the same on every machine and in CI since both times
+scale with the speed and the load of the machine. The benchmark fails if it is more than the tolerance above its
+baseline, or if a module deferred on purpose is imported at startup.
+
+    python benchmarks/importtime.py                    # compare with the baselines
+    python benchmarks/importtime.py --tolerance 0.1    # fail on smaller regressions
+"""
+
+from argparse   import ArgumentParser
+from pathlib    import Path
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The standard modules imported by both `subbot` and `subbotf`, taking most of their import time.
+REFERENCE = ['json', 'pathlib', 'shutil', 'subprocess', 'traceback']
+
+# The import time of each module over the one of the reference, measured on a single core VM where the reference takes
+# about 30-40 ms and the ratios vary by about 10%. Importing `concurrent.futures` at startup adds about 0.3 to both
+# ratios, `asyncio` about 1.5.
+BASELINES = {
+    'subbot': 1.65,
+    'subbotf': 1.85,
+}
+# The fraction of its baseline a module may take on top of it.
+TOLERANCE = 0.15
+
+# The modules that must not be imported at startup, they are imported where they are used.
+DEFERRED = {
+    'subbot': ['asyncio', 'argparse', 'concurrent.futures', 'hashlib', 'sqlite3', 'mimetypes', 'pymkv.MKVFile',
+               'pymkv.ASS', 'pymkv.EBML'],
+    'subbotf': ['asyncio', 'concurrent.futures', 'hashlib', 'sqlite3', 'mimetypes', 'pymkv.MKVFile', 'pymkv.ASS',
+                'pymkv.EBML', 'tqdm', 'yaml', 'ctypes'],
+}
+
+# Import `modules` in a fresh interpreter, return the sum of their cumulative import times in microseconds and the
+# modules imported.
+def import_time(modules):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    cumulative = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        # The modules imported by the command are the ones that are not indented.
+        if name.strip() in modules and not name[1:].startswith(' '):
+            cumulative += int(cumulative_us)
+    return cumulative, imported
+
+def main(args):
+    parser = ArgumentParser(description='Measure the import time of subbot and subbotf.')
+    parser.add_argument('modules', nargs='*', default=list(BASELINES),
+                        help='modules to measure (default: %(default)s)')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='imports per module (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='fraction of its baseline a module may take on top of it (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    failed = False
+    for module in options.modules:
+        times = []
+        reference_times = []
+        for _ in range(options.runs):
+            cumulative, imported = import_time([module])
+            times.append(cumulative)
+            reference_times.append(import_time(REFERENCE)[0])
+        # The best run is the least disturbed by the rest of the system.
+        ratio = min(times) / min(reference_times)
+        line = f'{module}: {min(times) / 1000:.1f} ms, {ratio:.2f}x the reference'
+        if module in BASELINES:
+            line += f' (baseline {BASELINES[module]:.2f}x)'
+            if ratio > BASELINES[module] * (1 + options.tolerance):
+                line += ' REGRESSED'
+                failed = True
+        print(line)
+        for deferred in DEFERRED.get(module, []):
+            if deferred in imported:
+                print(f'{module}: {deferred} is imported at startup')
+                failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
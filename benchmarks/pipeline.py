@@ -0,0 +1,220 @@
+"""End-to-end benchmark of `subbot` and `subbotf`, run offline against `fake_mkvmerge.py`.
+
+For every size, a tree of videos (minimal Matroska files, sparse up to `--video-size`) and of ASS subtitles named with
+properties is generated, then every tool is run on it in a fresh interpreter, as from the shell, with the identify
+cache starting empty. The benchmark reports:
+
+* the `mkvmerge` processes spawned, to identify files and to mux them;
+* the planning time, from the launch of the tool to the start of its first mux;
+* the time to the first output printed;
+* the wall time and the throughput of the whole batch, in muxes and bytes written per second.
+
+    python benchmarks/pipeline.py                     # 10, 1000 and 10000 files
+    python benchmarks/pipeline.py --sizes 10,100 --strict --jobs 8
+
+`subbotf` is skipped if PyYAML or tqdm are not installed.
+"""
+
+from argparse   import ArgumentParser
+import json
+import os
+from pathlib    import Path
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_MKVMERGE = Path(__file__).resolve().parent / 'fake_mkvmerge.py'
+
+sys.path.insert(0, str(ROOT))
+from pymkv.EBML import CODEC_ID, EBML_HEADER, INFO, LANGUAGE, SEGMENT, TITLE, TRACK_ENTRY, TRACK_NUMBER, TRACK_TYPE, \
+    TRACK_UID, TRACKS, VOID
+
+DOC_TYPE = 0x4282
+DOC_TYPE_VERSION = 0x4287
+DOC_TYPE_READ_VERSION = 0x4285
+
+SUBTITLES = '''[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, \
+StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,72,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,3,0,2,60,60,50,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+'''
+
+
+def element(element_id, payload):
+    # The sizes are always written on 8 bytes, which makes the headers easy to compute.
+    return (element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+            + ((1 << 56) | len(payload)).to_bytes(8, 'big') + payload)
+
+
+def uint_element(element_id, value):
+    return element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+
+def track_entry(number, track_type, codec_id, language):
+    return element(TRACK_ENTRY, uint_element(TRACK_NUMBER, number) + uint_element(TRACK_UID, number)
+                   + uint_element(TRACK_TYPE, track_type) + element(CODEC_ID, codec_id.encode())
+                   + element(LANGUAGE, language.encode()))
+
+
+# Write a Matroska file with a video and an audio track, followed by a void element up to `size` bytes, left sparse.
+def write_matroska(path, size):
+    header = element(EBML_HEADER, element(DOC_TYPE, b'matroska') + uint_element(DOC_TYPE_VERSION, 4)
+                     + uint_element(DOC_TYPE_READ_VERSION, 2))
+    body = element(INFO, element(TITLE, path.stem.encode())) + element(TRACKS, (
+        track_entry(1, 1, 'V_MPEG4/ISO/AVC', 'und') + track_entry(2, 2, 'A_AAC', 'jpn')))
+    # The segment has an unknown size, it extends up to the end of the file.
+    data = header + SEGMENT.to_bytes(4, 'big') + b'\x01\xff\xff\xff\xff\xff\xff\xff' + body
+    void_size = max(0, size - len(data) - 9)
+    with open(path, 'wb') as file:
+        file.write(data + VOID.to_bytes(1, 'big') + ((1 << 56) | void_size).to_bytes(8, 'big'))
+        file.truncate(len(data) + 9 + void_size)
+
+
+def make_tree(directory, count, video_size):
+    (directory / 'videos').mkdir()
+    (directory / 'subtitles').mkdir()
+    for index in range(count):
+        stem = f'{index:05}'
+        write_matroska(directory / 'videos' / f'{stem}.mkv', video_size)
+        (directory / 'subtitles' / f"{stem} ['English'][default][eng].ass").write_text(SUBTITLES)
+
+
+# Run `command`, return the metrics of the run from its output and from the log of the fake mkvmerge.
+def measure(command, env, log_path, output_dir):
+    start = time.time()
+    first_output = None
+    outputs = 0
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True)
+    for line in process.stdout:
+        if line.strip():
+            outputs += 1
+            if first_output is None:
+                first_output = time.time() - start
+    process.wait()
+    wall = time.time() - start
+
+    invocations = []
+    if log_path.exists():
+        invocations = [json.loads(line) for line in log_path.read_text().splitlines()]
+    mux_starts = [invocation['start'] for invocation in invocations if invocation['mode'] == 'mux']
+    bytes_written = sum(path.stat().st_size for path in output_dir.iterdir() if path.suffix == '.mkv')
+    return {
+        'returncode': process.returncode,
+        'outputs': outputs,
+        'identify': sum(invocation['mode'] == 'identify' for invocation in invocations),
+        'mux': len(mux_starts),
+        'other': sum(invocation['mode'] not in {'identify', 'mux'} for invocation in invocations),
+        'planning': min(mux_starts) - start if mux_starts else None,
+        'first_output': first_output,
+        'wall': wall,
+        'muxes_per_second': len(mux_starts) / wall,
+        'bytes_per_second': bytes_written / wall,
+    }
+
+
+def subbot_command(fake, options, tree, output_dir):
+    files = sorted(map(str, (tree / 'videos').iterdir())) + sorted(map(str, (tree / 'subtitles').iterdir()))
+    script = 'import sys, subbot; subbot.MKVMERGE_PATH = sys.argv[1]; subbot.handle_sigint(); subbot.main(sys.argv[2:])'
+    return [sys.executable, '-c', script, str(fake), *options, *files, str(output_dir)], {}
+
+
+def subbotf_command(fake, options, tree, output_dir):
+    projects = tree / 'projects.yaml'
+    projects.write_text(json.dumps({ # JSON is valid YAML
+        'projects': {'bench': {'videos': f'{tree}/videos/*.mkv', 'subtitles': f'{tree}/subtitles/*.ass',
+                               'output_path': str(output_dir)}},
+        'mkvmerge_path': str(fake),
+    }))
+    return [sys.executable, str(ROOT / 'subbotf.py'), *options, 'bench/*'], {'SUBBOTF_PROJECTS': str(projects)}
+
+
+def has_subbotf_dependencies():
+    try:
+        import tqdm, yaml
+    except ImportError:
+        return False
+    return True
+
+
+def format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.3f}'
+
+
+def main(args):
+    parser = ArgumentParser(description='Benchmark subbot and subbotf end to end with a fake mkvmerge.')
+    parser.add_argument('--sizes', default='10,1000,10000', help='numbers of videos (default: %(default)s)')
+    parser.add_argument('--tools', default='subbot,subbotf', help='tools to run (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=4, help='muxes run at the same time (default: %(default)s)')
+    parser.add_argument('--strict', action='store_true', help='identify every file with the fake mkvmerge')
+    parser.add_argument('--video-size', type=int, default=64 * 1024 * 1024,
+                        help='size of every video, in bytes (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds spent by every mux before writing (default: %(default)s)')
+    parser.add_argument('--throughput', type=float, default=2 * 1024 ** 3,
+                        help='bytes muxed per second (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON lines')
+    options = parser.parse_args(args)
+
+    tools = {'subbot': subbot_command, 'subbotf': subbotf_command}
+    selected = [tool for tool in options.tools.split(',') if tool]
+    if 'subbotf' in selected and not has_subbotf_dependencies():
+        print('PyYAML or tqdm not installed, skipping subbotf.', file=sys.stderr)
+        selected.remove('subbotf')
+    tool_options = ['--jobs', str(options.jobs)] + (['--strict'] if options.strict else [])
+
+    if not options.json:
+        print(f"{'tool':8} {'files':>6} {'identify':>8} {'mux':>6} {'planning':>9} {'first':>8} {'wall':>9} "
+              f"{'mux/s':>8} {'MB/s':>9}")
+    with tempfile.TemporaryDirectory(prefix='subbot-bench-') as temporary:
+        temporary = Path(temporary)
+        fake = temporary / 'mkvmerge'
+        fake.write_text(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(str(FAKE_MKVMERGE))} "$@"\n')
+        fake.chmod(0o755)
+
+        for size in map(int, options.sizes.split(',')):
+            tree = temporary / f'tree-{size}'
+            tree.mkdir()
+            make_tree(tree, size, options.video_size)
+            for tool in selected:
+                output_dir = tree / f'output-{tool}'
+                output_dir.mkdir()
+                log_path = tree / f'{tool}.log'
+                command, env = tools[tool](fake, tool_options, tree, output_dir)
+                env = {
+                    **os.environ,
+                    **env,
+                    'PYMKV_IDENTIFY_CACHE': str(tree / f'{tool}-identify.sqlite3'),
+                    'FAKE_MKVMERGE_LOG': str(log_path),
+                    'FAKE_MKVMERGE_LATENCY': str(options.latency),
+                    'FAKE_MKVMERGE_THROUGHPUT': str(options.throughput),
+                }
+                result = measure(command, env, log_path, output_dir)
+                if options.json:
+                    print(json.dumps({'tool': tool, 'files': size, **result}), flush=True)
+                else:
+                    print(f"{tool:8} {size:>6} {result['identify']:>8} {result['mux']:>6} "
+                          f"{format_seconds(result['planning']):>9} {format_seconds(result['first_output']):>8} "
+                          f"{result['wall']:>9.3f} {result['muxes_per_second']:>8.1f} "
+                          f"{result['bytes_per_second'] / 1e6:>9.1f}", flush=True)
+                if result['returncode'] != 0 or result['outputs'] != size:
+                    print(f'{tool} failed on {size} files: return code {result["returncode"]}, '
+                          f'{result["outputs"]} outputs', file=sys.stderr)
+            shutil.rmtree(tree)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+"""A minimal reader of SubStation Alpha and Advanced SubStation Alpha subtitles, used to identify them without running
+mkvmerge and to find the fonts they use.
+
+Examples
+--------
+>>> from pymkv.ASS import probe_ass, used_fonts
+>>> info = probe_ass('path/to/subtitles.ass')
+>>> if info is None:
+...     info = identify_file('path/to/subtitles.ass')
+>>> used_fonts('path/to/subtitles.ass')
+{('Arial', False, False), ('Arial', True, False)}
+"""
+
+from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE
+import re
+
+# Number of bytes read to find the header and the script type.
+HEADER_SIZE = 4096
+
+BOMS = (
+    (BOM_UTF8, 'utf-8'),
+    (BOM_UTF16_LE, 'utf-16-le'),
+    (BOM_UTF16_BE, 'utf-16-be'),
+)
+
+
+def decode_header(data):
+    """Decode the first bytes of a text file, according to its byte order mark.
+
+    Parameters
+    ----------
+    data : bytes
+        The first bytes of the file.
+
+    Returns
+    -------
+    tuple of str
+        The decoded text, without the byte order mark, and the name of its encoding.
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return data[len(bom):].decode(encoding, errors='ignore'), encoding
+    return data.decode('utf-8', errors='replace'), 'utf-8'
+
+
+# An override block of a dialogue line, e.g. `{\\fnArial\\b1}`.
+OVERRIDE_BLOCK = re.compile(r'(\{[^}]*\})')
+# The override tags changing the font of the text that follows: font name, bold, italic, reset and drawing mode.
+FONT_TAG = re.compile(r'\\(?:fn([^\\}]*)|b(\d*)\s*(?=[\\}])|i(\d*)\s*(?=[\\}])|r([^\\}]*)|p(\d*)\s*(?=[\\}]))')
+
+
+def is_ass_header(text):
+    """Whether `text`, the beginning of a file, is the beginning of SSA/ASS subtitles."""
+    return text.lstrip().startswith('[Script Info]')
+
+
+def probe_ass(file_path):
+    """Identify SSA/ASS subtitles by reading their header.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file to be identified.
+
+    Returns
+    -------
+    dict, None
+        The fields of `mkvmerge -J <file_path>` used by pymkv, or None if `file_path` does not start with a
+        `[Script Info]` section.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            text, encoding = decode_header(file.read(HEADER_SIZE))
+    except OSError:
+        return None
+    if not is_ass_header(text):
+        return None
+
+    codec_id = 'S_TEXT/ASS'
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        if key.strip().lower() == 'scripttype':
+            if value.strip().lower() == 'v4.00':
+                codec_id = 'S_TEXT/SSA'
+            break
+    return {
+        'container': {
+            'properties': {},
+            'recognized': True,
+            'supported': True,
+            'type': 'SSA/ASS subtitles',
+        },
+        'tracks': [{
+            'id': 0,
+            'type': 'subtitles',
+            'codec': 'SubStationAlpha',
+            'properties': {
+                'codec_id': codec_id,
+                'encoding': encoding.upper(),
+                'language': 'und',
+                'number': 1,
+                'text_subtitles': True,
+            },
+        }],
+    }
+
+
+def _parse_format(line):
+    return [field.strip().lower() for field in line.partition(':')[2].split(',')]
+
+
+def _is_bold(value, default):
+    # 1 or a weight of at least 600 is bold, 0 or a lighter weight is not, nothing restores the style.
+    if not value:
+        return default
+    value = int(value)
+    return value == 1 or value >= 600
+
+
+def used_fonts(file_path):
+    """Find the fonts used by SSA/ASS subtitles.
+
+    The fonts of the styles of the dialogue lines are followed through their `\\fn`, `\\b`, `\\i` and `\\r` override
+    tags, so that the styles and the fonts that no text uses are left out, as are the drawings.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the subtitles.
+
+    Returns
+    -------
+    set of tuple
+        The fonts used, as their name, whether they are bold and whether they are italic.
+
+    Raises
+    ------
+    OSError
+        Raised if `file_path` could not be read.
+    """
+    with open(file_path, 'rb') as file:
+        text, _ = decode_header(file.read())
+
+    styles = {} # name -> font name, bold, italic
+    style_format = event_format = None
+    section = None
+    dialogues = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            section = line.lower()
+        elif section in {'[v4+ styles]', '[v4 styles]'} and line.lower().startswith('format:'):
+            style_format = _parse_format(line)
+        elif section in {'[v4+ styles]', '[v4 styles]'} and line.lower().startswith('style:') and style_format:
+            fields = dict(zip(style_format, (field.strip() for field in line.partition(':')[2].split(','))))
+            styles[fields.get('name', '')] = (fields.get('fontname', '').lstrip('@'),
+                                              fields.get('bold', '0') not in {'', '0'},
+                                              fields.get('italic', '0') not in {'', '0'})
+        elif section == '[events]' and line.lower().startswith('format:'):
+            event_format = _parse_format(line)
+        elif section == '[events]' and line.lower().startswith('dialogue:') and event_format:
+            # the text is the last field, it can contain commas
+            fields = dict(zip(event_format, line.partition(':')[2].split(',', len(event_format) - 1)))
+            dialogues.append((fields.get('style', '').strip().lstrip('*'), fields.get('text', '')))
+
+    fonts = set()
+    default_style = styles.get('Default') or next(iter(styles.values()), None)
+    for style_name, dialogue in dialogues:
+        event_style = line_style = styles.get(style_name, default_style)
+        if line_style is None:
+            continue
+        name, bold, italic = line_style
+        drawing = False
+        for part in OVERRIDE_BLOCK.split(dialogue):
+            if not part.startswith('{'):
+                if part and name and not drawing:
+                    fonts.add((name, bold, italic))
+                continue
+            for match in FONT_TAG.finditer(part):
+                tag = match[0][1]
+                if tag == 'f':
+                    name = match[1].strip().lstrip('@') or line_style[0]
+                elif tag == 'b':
+                    bold = _is_bold(match[2], line_style[1])
+                elif tag == 'i':
+                    italic = bool(int(match[3])) if match[3] else line_style[2]
+                elif tag == 'r':
+                    # `\\r` restores the style of the line, `\\rName` the style `Name`
+                    line_style = styles.get(match[4].strip(), event_style) if match[4].strip() else event_style
+                    name, bold, italic = line_style
+                else:
+                    drawing = bool(match[5]) and int(match[5]) > 0
+    return fonts
@@ -0,0 +1,574 @@
+"""A minimal reader and editor of the EBML structure of Matroska files, used to identify them without running
+mkvmerge and to change the properties of their tracks without remuxing them.
+
+Only the EBML header, the SeekHead, Info and Tracks elements of the Segment and the headers of its attachments are
+read, with small bounded reads, so the cost of a probe does not depend on the size of the file.
+:func:`~pymkv.EBML.probe_matroska` returns the same fields pymkv takes from `mkvmerge -J`, and None for anything it
+cannot decode with certainty, so that the caller can fall back to mkvmerge. :func:`~pymkv.EBML.edit_track_entries`
+rewrites the Tracks element where it is, which only writes a few KiB whatever the size of the file.
+
+Examples
+--------
+>>> from pymkv.EBML import edit_track_entries, probe_matroska
+>>> info = probe_matroska('path/to/file.mkv')
+>>> if info is None:
+...     info = identify_file('path/to/file.mkv')
+>>> if not edit_track_entries('path/to/file.mkv', {2: {'language': 'fre', 'default_track': False}}):
+...     print('No room for the edits, remux the file.')
+"""
+
+from os import fstat, fsync
+from zlib import crc32
+
+EBML_HEADER = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TITLE = 0x7BA9
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+FLAG_ENABLED = 0xB9
+FLAG_DEFAULT = 0x88
+FLAG_FORCED = 0x55AA
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+CODEC_ID = 0x86
+ATTACHMENTS = 0x1941A469
+ATTACHED_FILE = 0x61A7
+FILE_DESCRIPTION = 0x467E
+FILE_NAME = 0x466E
+FILE_MIME_TYPE = 0x4660
+FILE_DATA = 0x465C
+FILE_UID = 0x46AE
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+
+# The size of an element whose size is unknown, i.e. it extends up to the end of its parent.
+UNKNOWN_SIZE = -1
+
+# Longest element read in memory, larger ones are left to mkvmerge.
+MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+# Number of top-level elements looked at before falling back to the SeekHead.
+MAX_TOP_LEVEL_ELEMENTS = 64
+
+TRACK_TYPES = {
+    1: 'video',
+    2: 'audio',
+    0x11: 'subtitles',
+    0x12: 'buttons',
+}
+
+# The codec names mkvmerge reports for the most common codec ids. Any other codec id is left to mkvmerge.
+CODECS = {
+    'V_MPEG4/ISO/AVC': 'AVC/H.264/MPEG-4p10',
+    'V_MPEGH/ISO/HEVC': 'HEVC/H.265/MPEG-H',
+    'V_AV1': 'AV1',
+    'V_VP8': 'VP8',
+    'V_VP9': 'VP9',
+    'V_MPEG1': 'MPEG-1/2',
+    'V_MPEG2': 'MPEG-1/2',
+    'A_AAC': 'AAC',
+    'A_AAC/MPEG2/LC': 'AAC',
+    'A_AAC/MPEG4/LC': 'AAC',
+    'A_AC3': 'AC-3',
+    'A_EAC3': 'E-AC-3',
+    'A_DTS': 'DTS',
+    'A_FLAC': 'FLAC',
+    'A_OPUS': 'Opus',
+    'A_VORBIS': 'Vorbis',
+    'A_MPEG/L2': 'MP2',
+    'A_MPEG/L3': 'MP3',
+    'A_PCM/INT/LIT': 'PCM',
+    'A_TRUEHD': 'TrueHD',
+    'S_TEXT/ASS': 'SubStationAlpha',
+    'S_TEXT/SSA': 'SubStationAlpha',
+    'S_ASS': 'SubStationAlpha',
+    'S_SSA': 'SubStationAlpha',
+    'S_TEXT/UTF8': 'SubRip/SRT',
+    'S_TEXT/WEBVTT': 'WebVTT',
+    'S_HDMV/PGS': 'HDMV PGS',
+    'S_VOBSUB': 'VobSub',
+}
+
+
+def read_vint(data, pos, keep_marker=False):
+    """Read a variable size integer.
+
+    Parameters
+    ----------
+    data : bytes
+        The buffer containing the integer.
+    pos : int
+        The position of the integer in `data`.
+    keep_marker : bool, optional
+        Keep the length marker in the value, as in element ids.
+
+    Returns
+    -------
+    tuple of int
+        The value and the length of the integer. The value is :data:`UNKNOWN_SIZE` if all its bits are set.
+
+    Raises
+    ------
+    ValueError
+        Raised if `data` does not contain a valid integer at `pos`.
+    """
+    first = data[pos]
+    if first == 0:
+        raise ValueError('invalid EBML variable size integer')
+    length = 9 - first.bit_length()
+    if pos + length > len(data):
+        raise ValueError('truncated EBML variable size integer')
+    value = int.from_bytes(data[pos:pos + length], 'big')
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return UNKNOWN_SIZE, length
+    return value, length
+
+
+def encode_vint(value, length=None):
+    """Encode a variable size integer.
+
+    Parameters
+    ----------
+    value : int
+        The value to encode.
+    length : int, optional
+        The length of the integer, in bytes. By default, the shortest one holding `value`.
+
+    Raises
+    ------
+    ValueError
+        Raised if `value` does not fit in `length` bytes, or in 8 bytes.
+    """
+    if length is None:
+        length = 1
+        # a value with all its bits set would be read as an unknown size
+        while length < 8 and value >= (1 << (7 * length)) - 1:
+            length += 1
+    if not 1 <= length <= 8 or not 0 <= value < (1 << (7 * length)) - 1:
+        raise ValueError('value too large for an EBML variable size integer')
+    return ((1 << (7 * length)) | value).to_bytes(length, 'big')
+
+
+def encode_element(element_id, data, size_length=None):
+    """Encode an element, its size written on `size_length` bytes or as few as possible."""
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + encode_vint(len(data), size_length) + data
+
+
+def encode_uint(element_id, value):
+    return encode_element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+
+def encode_string(element_id, value):
+    return encode_element(element_id, value.encode())
+
+
+def encode_void(length):
+    """Encode a Void element of `length` bytes in total, header included.
+
+    Raises
+    ------
+    ValueError
+        Raised if `length` is less than 2, the size of the smallest Void element.
+    """
+    if length < 2:
+        raise ValueError('an EBML Void element takes at least 2 bytes')
+    # A 1-byte size holds the Void elements up to 128 bytes, an 8-byte size the larger ones.
+    size_length = 1 if length <= 128 else 8
+    return encode_element(VOID, bytes(length - 1 - size_length), size_length)
+
+
+def read_element_header(file, pos):
+    """Read the id and the size of the element at `pos`.
+
+    Returns
+    -------
+    tuple of int
+        The id of the element, its size and the position of its data.
+    """
+    file.seek(pos)
+    data = file.read(12)
+    element_id, id_length = read_vint(data, 0, keep_marker=True)
+    if id_length > 4:
+        raise ValueError('invalid EBML element id')
+    size, size_length = read_vint(data, id_length)
+    return element_id, size, pos + id_length + size_length
+
+
+def iter_elements(data, pos=0, end=None):
+    """Iterate over the elements contained in `data`.
+
+    Yields
+    ------
+    tuple of int
+        The id of every element, the position of its data and the position of its end.
+    """
+    end = len(data) if end is None else end
+    while pos < end:
+        element_id, id_length = read_vint(data, pos, keep_marker=True)
+        size, size_length = read_vint(data, pos + id_length)
+        start = pos + id_length + size_length
+        if size == UNKNOWN_SIZE or start + size > end:
+            raise ValueError('EBML element overflows its parent')
+        yield element_id, start, start + size
+        pos = start + size
+
+
+def read_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+
+def read_string(data, start, end):
+    return data[start:end].rstrip(b'\0').decode()
+
+
+def _read_body(file, start, size):
+    if size == UNKNOWN_SIZE or size > MAX_ELEMENT_SIZE:
+        raise ValueError('EBML element too large')
+    file.seek(start)
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError('truncated EBML element')
+    return data
+
+
+def _parse_seek_head(data):
+    positions = {}
+    for element_id, start, end in iter_elements(data):
+        if element_id != SEEK:
+            continue
+        seek_id = seek_position = None
+        for child_id, child_start, child_end in iter_elements(data, start, end):
+            if child_id == SEEK_ID:
+                seek_id = read_uint(data, child_start, child_end)
+            elif child_id == SEEK_POSITION:
+                seek_position = read_uint(data, child_start, child_end)
+        if seek_id is not None and seek_position is not None:
+            positions.setdefault(seek_id, seek_position)
+    return positions
+
+
+def _parse_info(data):
+    properties = {}
+    for element_id, start, end in iter_elements(data):
+        if element_id == TITLE:
+            properties['title'] = read_string(data, start, end)
+    return properties
+
+
+def _parse_track_entry(data, start, end):
+    entry = {
+        'flag_enabled': 1,
+        'flag_default': 1,
+        'flag_forced': 0,
+        'language': 'eng',
+    }
+    for element_id, child_start, child_end in iter_elements(data, start, end):
+        if element_id == TRACK_NUMBER:
+            entry['number'] = read_uint(data, child_start, child_end)
+        elif element_id == TRACK_UID:
+            entry['uid'] = read_uint(data, child_start, child_end)
+        elif element_id == TRACK_TYPE:
+            entry['type'] = read_uint(data, child_start, child_end)
+        elif element_id == FLAG_ENABLED:
+            entry['flag_enabled'] = read_uint(data, child_start, child_end)
+        elif element_id == FLAG_DEFAULT:
+            entry['flag_default'] = read_uint(data, child_start, child_end)
+        elif element_id == FLAG_FORCED:
+            entry['flag_forced'] = read_uint(data, child_start, child_end)
+        elif element_id == NAME:
+            entry['name'] = read_string(data, child_start, child_end)
+        elif element_id == LANGUAGE:
+            entry['language'] = read_string(data, child_start, child_end)
+        elif element_id == LANGUAGE_BCP47:
+            entry['language_ietf'] = read_string(data, child_start, child_end)
+        elif element_id == CODEC_ID:
+            entry['codec_id'] = read_string(data, child_start, child_end)
+    return entry
+
+
+def _parse_tracks(data):
+    tracks = []
+    for element_id, start, end in iter_elements(data):
+        if element_id == CRC32:
+            continue
+        if element_id != TRACK_ENTRY:
+            raise ValueError('unexpected element in Tracks')
+        entry = _parse_track_entry(data, start, end)
+        track_type = TRACK_TYPES.get(entry.get('type'))
+        codec = CODECS.get(entry.get('codec_id'))
+        if track_type is None or codec is None or 'number' not in entry:
+            raise ValueError('unsupported track')
+        properties = {
+            'codec_id': entry['codec_id'],
+            'default_track': bool(entry['flag_default']),
+            'enabled_track': bool(entry['flag_enabled']),
+            'forced_track': bool(entry['flag_forced']),
+            'language': entry['language'],
+            'number': entry['number'],
+        }
+        if 'uid' in entry:
+            properties['uid'] = entry['uid']
+        if 'name' in entry:
+            properties['track_name'] = entry['name']
+        if 'language_ietf' in entry:
+            properties['language_ietf'] = entry['language_ietf']
+        tracks.append({
+            'id': len(tracks),
+            'type': track_type,
+            'codec': codec,
+            'properties': properties,
+        })
+    return tracks
+
+
+def probe_matroska(file_path):
+    """Identify a Matroska file by reading its headers.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file to be identified.
+
+    Returns
+    -------
+    dict, None
+        The fields of `mkvmerge -J <file_path>` used by pymkv, or None if `file_path` is not a Matroska file or could
+        not be decoded.
+    """
+    try:
+        with open(file_path, 'rb', buffering=0) as file:
+            return _probe_matroska(file)
+    except (OSError, ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+
+def _probe_matroska(file):
+    segment = _read_segment(file)
+    if segment is None or TRACKS not in segment[0]:
+        return None
+    elements, _, attachments = segment
+    return {
+        'attachments': _read_attachments(file, *attachments) if attachments else [],
+        'container': {
+            'properties': _parse_info(elements[INFO][2]) if INFO in elements else {},
+            'recognized': True,
+            'supported': True,
+            'type': 'Matroska',
+        },
+        'tracks': _parse_tracks(elements[TRACKS][2]),
+    }
+
+
+def _read_attachments(file, start, end):
+    # Only the headers of the attached files are read, their data is skipped.
+    attachments = []
+    pos = start
+    while pos < end:
+        element_id, size, data_start = read_element_header(file, pos)
+        if size == UNKNOWN_SIZE:
+            raise ValueError('EBML element of unknown size in Attachments')
+        if element_id == ATTACHED_FILE:
+            attachment = {'id': len(attachments), 'properties': {}}
+            child_pos = data_start
+            while child_pos < data_start + size:
+                child_id, child_size, child_start = read_element_header(file, child_pos)
+                if child_size == UNKNOWN_SIZE:
+                    raise ValueError('EBML element of unknown size in AttachedFile')
+                if child_id == FILE_DATA:
+                    attachment['size'] = child_size
+                elif child_id in {FILE_NAME, FILE_MIME_TYPE, FILE_DESCRIPTION, FILE_UID}:
+                    data = _read_body(file, child_start, child_size)
+                    if child_id == FILE_NAME:
+                        attachment['file_name'] = read_string(data, 0, child_size)
+                    elif child_id == FILE_MIME_TYPE:
+                        attachment['content_type'] = read_string(data, 0, child_size)
+                    elif child_id == FILE_DESCRIPTION:
+                        attachment['description'] = read_string(data, 0, child_size)
+                    else:
+                        attachment['properties']['uid'] = read_uint(data, 0, child_size)
+                child_pos = child_start + child_size
+            attachments.append(attachment)
+        pos = data_start + size
+    return attachments
+
+
+def _read_segment(file):
+    # Return the Info and Tracks elements of the first segment, by id, as the position of their header, the position
+    # of their data and their data, the end of the segment and the start and end of the data of its Attachments
+    # element, if any. Return None if `file` is not a Matroska file.
+    file_size = fstat(file.fileno()).st_size
+
+    element_id, size, start = read_element_header(file, 0)
+    if element_id != EBML_HEADER:
+        return None
+    header = _read_body(file, start, size)
+    doc_type = None
+    for child_id, child_start, child_end in iter_elements(header):
+        if child_id == DOC_TYPE:
+            doc_type = read_string(header, child_start, child_end)
+    if doc_type not in {'matroska', 'webm'}:
+        return None
+
+    element_id, size, segment_start = read_element_header(file, start + size)
+    if element_id != SEGMENT:
+        return None
+    segment_end = file_size if size == UNKNOWN_SIZE else min(segment_start + size, file_size)
+
+    elements = {} # id -> position, data position and data of the top-level elements read
+    attachments = None
+    seek_positions = {}
+    pos = segment_start
+    for _ in range(MAX_TOP_LEVEL_ELEMENTS):
+        # Without a SeekHead, the attachments are looked for up to the first cluster.
+        if pos >= segment_end or (INFO in elements and TRACKS in elements
+                                  and (attachments is not None or SEEK_HEAD in elements)):
+            break
+        element_id, size, start = read_element_header(file, pos)
+        if element_id == CLUSTER or size == UNKNOWN_SIZE:
+            break
+        if element_id in {SEEK_HEAD, INFO, TRACKS} and element_id not in elements:
+            elements[element_id] = (pos, start, _read_body(file, start, size))
+            if element_id == SEEK_HEAD:
+                seek_positions.update(_parse_seek_head(elements[SEEK_HEAD][2]))
+        elif element_id == ATTACHMENTS and attachments is None:
+            attachments = (start, start + size)
+        pos = start + size
+
+    # The elements placed after the clusters are found through the SeekHead, which can point to another one.
+    for element_id in (SEEK_HEAD, INFO, TRACKS):
+        if (element_id in elements and element_id != SEEK_HEAD) or element_id not in seek_positions:
+            continue
+        pos = segment_start + seek_positions[element_id]
+        found_id, size, start = read_element_header(file, pos)
+        if found_id != element_id:
+            return None
+        data = _read_body(file, start, size)
+        if element_id == SEEK_HEAD:
+            for seek_id, seek_position in _parse_seek_head(data).items():
+                seek_positions.setdefault(seek_id, seek_position)
+        else:
+            elements[element_id] = (pos, start, data)
+    if attachments is None and ATTACHMENTS in seek_positions:
+        found_id, size, start = read_element_header(file, segment_start + seek_positions[ATTACHMENTS])
+        if found_id != ATTACHMENTS or size == UNKNOWN_SIZE:
+            return None
+        attachments = (start, start + size)
+
+    elements.pop(SEEK_HEAD, None)
+    return elements, segment_end, attachments
+
+
+def edit_track_entries(file_path, edits):
+    """Edit the name, the language and the flags of tracks of a Matroska file in place, without remuxing it.
+
+    The Tracks element is rewritten where it is. If it grows, it takes the room of the Void element following it, if
+    any, and if it shrinks, a Void element fills the space it leaves, so that no other element moves. If the edits do
+    not fit, the file is left untouched.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file to be edited.
+    edits : dict
+        The properties to set, by index of the track in the file, as in `mkvmerge -J`: a dict of `track_name` (None
+        removes the name), `language` (an ISO 639-2 code), `default_track` and `forced_track`, each one optional.
+
+    Returns
+    -------
+    bool
+        True if the file was edited, False if there was no room for the edits.
+
+    Raises
+    ------
+    ValueError
+        Raised if `file_path` is not a Matroska file that could be decoded, or has no track at an index of `edits`.
+    OSError
+        Raised if `file_path` could not be read or written.
+    """
+    with open(file_path, 'r+b', buffering=0) as file:
+        segment = _read_segment(file)
+        if segment is None or TRACKS not in segment[0]:
+            raise ValueError('not a Matroska file with tracks')
+        elements, segment_end, _ = segment
+        pos, start, data = elements[TRACKS]
+        end = start + len(data)
+
+        children = []
+        has_crc = False
+        index = 0
+        child_pos = 0
+        for element_id, child_start, child_end in iter_elements(data):
+            if element_id == CRC32:
+                has_crc = True
+            elif element_id == TRACK_ENTRY and index in edits:
+                children.append(_edit_track_entry(data, child_start, child_end, edits[index]))
+            else:
+                children.append(data[child_pos:child_end])
+            index += element_id == TRACK_ENTRY
+            child_pos = child_end
+        if any(not 0 <= track_index < index for track_index in edits):
+            raise ValueError('track index out of range')
+        body = b''.join(children)
+        if has_crc:
+            # the CRC-32 of the other children, written first, little-endian
+            body = encode_element(CRC32, crc32(body).to_bytes(4, 'little')) + body
+
+        # the room of the Tracks element and of the Void element following it, if any
+        room_end = end
+        if end < segment_end:
+            element_id, size, void_start = read_element_header(file, end)
+            if element_id == VOID and size != UNKNOWN_SIZE:
+                room_end = min(void_start + size, segment_end)
+
+        id_length = (TRACKS.bit_length() + 7) // 8
+        size_length = max(start - pos - id_length, len(encode_vint(len(body))))
+        spare = room_end - pos - (id_length + size_length + len(body))
+        if spare == 1 and size_length < 8: # too small for a Void element, the size takes one more byte instead
+            size_length += 1
+            spare = 0
+        if spare < 0 or spare == 1:
+            return False
+
+        file.seek(pos)
+        file.write(encode_element(TRACKS, body, size_length) + (encode_void(spare) if spare else b''))
+        fsync(file.fileno())
+    return True
+
+
+def _edit_track_entry(data, start, end, properties):
+    children = []
+    replaced = {
+        NAME: 'track_name',
+        LANGUAGE: 'language',
+        # The BCP 47 language takes precedence over the ISO 639-2 one, it is removed so that the new one applies.
+        LANGUAGE_BCP47: 'language',
+        FLAG_DEFAULT: 'default_track',
+        FLAG_FORCED: 'forced_track',
+    }
+    child_pos = start
+    for element_id, child_start, child_end in iter_elements(data, start, end):
+        if replaced.get(element_id) not in properties:
+            children.append(data[child_pos:child_end])
+        child_pos = child_end
+    if properties.get('track_name') is not None:
+        children.append(encode_string(NAME, properties['track_name']))
+    if 'language' in properties:
+        children.append(encode_string(LANGUAGE, properties['language']))
+    if 'default_track' in properties:
+        children.append(encode_uint(FLAG_DEFAULT, int(properties['default_track'])))
+    if 'forced_track' in properties:
+        children.append(encode_uint(FLAG_FORCED, int(properties['forced_track'])))
+    return encode_element(TRACK_ENTRY, b''.join(children))
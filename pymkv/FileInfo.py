@@ -0,0 +1,71 @@
+"""Compact, immutable records of the identification of a file by `mkvmerge -J`.
+
+The output of `mkvmerge -J` is a tree of dictionaries holding much more than what muxing a file needs. A
+:class:`~pymkv.FileInfo.FileInfo` keeps only the type of the container, the title, the tracks and the names of the
+attachments, in tuples. The :class:`~pymkv.FileInfo.TrackInfo` records of identical tracks, e.g. the single track of
+every subtitle file of a library, are the same object, so that holding the identification of hundreds of thousands of
+files stays cheap.
+
+:class:`~pymkv.MKVFile` and :class:`~pymkv.MKVTrack` accept a :class:`~pymkv.FileInfo.FileInfo` wherever they accept
+the output of `mkvmerge -J`.
+
+Examples
+--------
+>>> from pymkv import FileInfo, MKVTrack, identify_file
+>>> info = FileInfo.from_info(identify_file('path/to/file.mkv'))
+>>> [track.type for track in info.tracks]
+['video', 'audio', 'subtitles']
+>>> track = MKVTrack('path/to/file.mkv', track_id=2, info=info)
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+from sys import intern
+
+
+class TrackInfo(namedtuple('TrackInfo', ['id', 'type', 'codec', 'track_name', 'language', 'default_track',
+                                         'forced_track'])):
+    """A track of a file. The properties missing from the identification are None."""
+    __slots__ = ()
+
+
+@lru_cache(maxsize=4096, typed=True)
+def _track_info(*fields):
+    return TrackInfo(*fields)
+
+
+def _intern(string):
+    return intern(string) if isinstance(string, str) else string
+
+
+class FileInfo(namedtuple('FileInfo', ['type', 'recognized', 'supported', 'title', 'tracks', 'attachments'])):
+    """A file identified by mkvmerge: the type of its container, whether it is recognized and supported, its title
+    or None, its tracks, as :class:`~pymkv.FileInfo.TrackInfo` records, and the file names of its attachments."""
+    __slots__ = ()
+
+    @classmethod
+    def from_info(cls, info):
+        """Make the record of an identification.
+
+        Parameters
+        ----------
+        info : dict or :class:`~pymkv.FileInfo.FileInfo`
+            The output of `mkvmerge -J`, or a record already made, returned as is.
+
+        Returns
+        -------
+        :class:`~pymkv.FileInfo.FileInfo`
+            The record of `info`.
+        """
+        if isinstance(info, cls):
+            return info
+        container = info['container']
+        tracks = []
+        for track in info.get('tracks', []):
+            properties = track.get('properties', {})
+            tracks.append(_track_info(track['id'], _intern(track['type']), _intern(track['codec']),
+                                      properties.get('track_name'), _intern(properties.get('language')),
+                                      properties.get('default_track'), properties.get('forced_track')))
+        return cls(_intern(container.get('type')), container['recognized'], container['supported'],
+                   container.get('properties', {}).get('title'), tuple(tracks),
+                   tuple(attachment.get('file_name', '') for attachment in info.get('attachments', [])))
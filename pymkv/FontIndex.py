@@ -0,0 +1,271 @@
+""":class:`~pymkv.FontIndex` finds the font files of the fonts named by subtitles, so that only the fonts they use are
+attached to a mux.
+
+The names and the style of every face of the TrueType and OpenType fonts (`.ttf`, `.otf`, `.ttc` and `.otc`) of the
+directories indexed are read from their `name` and `OS/2` tables. They are stored in a JSON file keyed by the path,
+the size and the modification time of the font, so that only the new or modified fonts are read again by later runs.
+The fonts deleted since are dropped from the file when it is written.
+
+Examples
+--------
+>>> from pymkv import FontIndex, MKVAttachment
+>>> from pymkv.ASS import used_fonts
+>>> index = FontIndex(['path/to/fonts'])
+>>> for name, bold, italic in used_fonts('path/to/subtitles.ass'):
+...     font_path = index.find(name, bold, italic)
+...     if font_path is not None:
+...         mkv.add_attachment(MKVAttachment(font_path))
+"""
+
+import json
+import os
+from os.path import dirname, exists, expanduser, join, realpath
+from struct import unpack
+import threading
+
+# The extensions of the font files indexed.
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc')
+
+# The ids of the names read from the `name` table: the family, the full name, the PostScript name and the typographic
+# family of the face.
+FAMILY_NAME_IDS = {1, 16}
+FACE_NAME_IDS = {4, 6}
+
+
+def default_cache_path():
+    """Get the default path of the font cache.
+
+    The path is taken from the $PYMKV_FONT_CACHE environment variable if it is set, otherwise the cache is placed in
+    the user's cache directory. An empty $PYMKV_FONT_CACHE disables the cache.
+
+    Returns
+    -------
+    str, None
+        The path of the cache, or None if the cache is disabled.
+    """
+    if 'PYMKV_FONT_CACHE' in os.environ:
+        return os.environ['PYMKV_FONT_CACHE'] or None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(cache_home, 'pymkv', 'fonts.json')
+
+
+def _read(file, offset, size):
+    file.seek(offset)
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError('truncated font file')
+    return data
+
+
+def _decode_name(platform_id, encoding_id, data):
+    if platform_id in {0, 3}: # Unicode and Windows
+        return data.decode('utf-16-be', errors='replace')
+    if platform_id == 1 and encoding_id == 0: # Macintosh Roman
+        return data.decode('mac_roman')
+    return None
+
+
+def _parse_name_table(data):
+    _, count, string_offset = unpack('>HHH', data[:6])
+    names = {} # name id -> set of names
+    for index in range(count):
+        platform_id, encoding_id, _, name_id, length, offset = unpack('>6H', data[6 + 12 * index:18 + 12 * index])
+        if name_id not in FAMILY_NAME_IDS | FACE_NAME_IDS:
+            continue
+        name = _decode_name(platform_id, encoding_id,
+                            data[string_offset + offset:string_offset + offset + length])
+        if name and name.strip():
+            names.setdefault(name_id, set()).add(name.strip())
+    return names
+
+
+def _read_face(file, offset):
+    num_tables, = unpack('>H', _read(file, offset + 4, 2))
+    directory = _read(file, offset + 12, 16 * num_tables)
+    tables = {}
+    for index in range(num_tables):
+        tag, _, table_offset, length = unpack('>4sIII', directory[16 * index:16 * index + 16])
+        tables[tag] = (table_offset, length)
+    if b'name' not in tables:
+        raise ValueError('font without a name table')
+    names = _parse_name_table(_read(file, *tables[b'name']))
+
+    weight = 400
+    italic = False
+    if b'OS/2' in tables and tables[b'OS/2'][1] >= 64:
+        os2 = _read(file, tables[b'OS/2'][0], 64)
+        weight, = unpack('>H', os2[4:6])
+        selection, = unpack('>H', os2[62:64])
+        italic = bool(selection & 0x01)
+    elif b'head' in tables and tables[b'head'][1] >= 46:
+        mac_style, = unpack('>H', _read(file, tables[b'head'][0] + 44, 2))
+        weight = 700 if mac_style & 0x01 else 400
+        italic = bool(mac_style & 0x02)
+    return {
+        'families': sorted(set().union(*(names.get(name_id, ()) for name_id in FAMILY_NAME_IDS))),
+        'names': sorted(set().union(*(names.get(name_id, ()) for name_id in FACE_NAME_IDS))),
+        'weight': weight,
+        'italic': italic,
+    }
+
+
+def read_font_faces(file_path):
+    """Read the names and the style of the faces of a font file.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of a TrueType or OpenType font, or of a collection of them.
+
+    Returns
+    -------
+    list of dict
+        Every face of the file, as its `families`, its full and PostScript `names`, its `weight`, from 100 to 900, and
+        whether it is `italic`.
+
+    Raises
+    ------
+    ValueError
+        Raised if `file_path` is not a font that could be decoded.
+    OSError
+        Raised if `file_path` could not be read.
+    """
+    with open(file_path, 'rb') as file:
+        tag = _read(file, 0, 4)
+        if tag == b'ttcf':
+            num_fonts, = unpack('>I', _read(file, 8, 4))
+            offsets = unpack(f'>{num_fonts}I', _read(file, 12, 4 * num_fonts))
+        elif tag in {b'\x00\x01\x00\x00', b'OTTO', b'true'}:
+            offsets = (0,)
+        else:
+            raise ValueError('not a TrueType or OpenType font')
+        return [_read_face(file, offset) for offset in offsets]
+
+
+class FontIndex:
+    """An index of the fonts of some directories, by name.
+
+    The directories are scanned on the first lookup. Every font that could not be read is left out.
+
+    Parameters
+    ----------
+    directories : list of str
+        The directories of the fonts, scanned recursively.
+    cache_path : str, optional
+        The path of the JSON file caching the faces of the fonts. By default it is the path returned by
+        :func:`~pymkv.FontIndex.default_cache_path`, if that is None the fonts are always read.
+    """
+
+    def __init__(self, directories, cache_path=None):
+        self.directories = [expanduser(directory) for directory in directories]
+        if cache_path is None:
+            cache_path = default_cache_path()
+        self.cache_path = expanduser(cache_path) if cache_path is not None else None
+        self._lock = threading.Lock()
+        self._families = None # name -> list of (path, face)
+        self._names = None
+
+    def __repr__(self):
+        return repr(self.__dict__)
+
+    def _font_paths(self):
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in sorted(files):
+                    if name.lower().endswith(FONT_EXTENSIONS):
+                        yield realpath(join(root, name))
+
+    def _load_cache(self):
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path) as cache:
+                fonts = json.load(cache).get('fonts', {})
+            return fonts if isinstance(fonts, dict) else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _indexed(self, path):
+        return any(path.startswith(join(realpath(directory), '')) for directory in self.directories)
+
+    def _save_cache(self, fonts, paths):
+        # The fonts of the other directories stay in the cache, it is shared by every index, unless they were deleted.
+        # The fonts of the indexed directories that were not found by the scan, i.e. the `paths`, are dropped.
+        temporary_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(dirname(self.cache_path) or '.', exist_ok=True)
+            cached = {path: entry for path, entry in self._load_cache().items()
+                      if path in paths or not self._indexed(path) and exists(path)}
+            with open(temporary_path, 'w') as cache:
+                json.dump({'version': 1, 'fonts': {**cached, **fonts}}, cache)
+            os.replace(temporary_path, self.cache_path)
+        except OSError:
+            try:
+                os.unlink(temporary_path)
+            except OSError:
+                pass
+
+    def _load(self):
+        with self._lock:
+            if self._families is not None:
+                return
+            cached = self._load_cache()
+            updated = {}
+            families = {}
+            names = {}
+            paths = dict.fromkeys(self._font_paths())
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = cached.get(path)
+                if not isinstance(entry, dict) or [entry.get('size'), entry.get('mtime_ns')] \
+                != [stat.st_size, stat.st_mtime_ns]:
+                    try:
+                        faces = read_font_faces(path)
+                    except (OSError, ValueError, IndexError, UnicodeDecodeError):
+                        faces = [] # cached too, so that it is not read again until it changes
+                    entry = updated[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'faces': faces}
+                for face in entry.get('faces', []):
+                    for family in face['families']:
+                        families.setdefault(family.casefold(), []).append((path, face))
+                    for name in face['names']:
+                        names.setdefault(name.casefold(), []).append((path, face))
+            stale = any(path not in paths and self._indexed(path) for path in cached)
+            if (updated or stale) and self.cache_path is not None:
+                self._save_cache(updated, paths)
+            self._families = families
+            self._names = names
+
+    def find(self, name, bold=False, italic=False):
+        """Find the font file of a font.
+
+        As renderers do, a family name selects the face of the family closest to the style asked for, while another
+        name matching the full or the PostScript name of a face selects it.
+
+        Parameters
+        ----------
+        name : str
+            The name of the font, as written in the subtitles.
+        bold : bool, optional
+            Whether the text is bold.
+        italic : bool, optional
+            Whether the text is italic.
+
+        Returns
+        -------
+        str, None
+            The path of the font file, or None if no font has this name.
+        """
+        self._load()
+        key = name.strip().casefold()
+        candidates = self._families.get(key)
+        if candidates:
+            # The face of the right slant with the closest weight, the renderer synthesises the rest of the style.
+            weight = 700 if bold else 400
+            path, _ = min(candidates, key=lambda candidate: (candidate[1]['italic'] != italic,
+                                                             abs(candidate[1].get('weight', 400) - weight)))
+            return path
+        faces = self._names.get(key)
+        return faces[0][0] if faces else None
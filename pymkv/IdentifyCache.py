@@ -0,0 +1,226 @@
+""":class:`~pymkv.IdentifyCache` stores the output of `mkvmerge -J` on disk, so that unchanged files are not
+identified again by every run.
+
+Entries are keyed by the real path of the file, its size, its modification time in nanoseconds, its inode and the
+identity of the mkvmerge executable, so that any change to the file or to mkvmerge invalidates them. The cache is a
+SQLite database in WAL mode, which can be shared by several processes running at the same time.
+
+The identifications of pymkv only go through a cache once :func:`~pymkv.Verifications.enable_identify_cache` has been
+called.
+
+Examples
+--------
+>>> from pymkv import IdentifyCache
+>>> cache = IdentifyCache('/path/to/identify.sqlite3')
+>>> key = cache.key('/path/to/file.mkv')
+>>> info = cache.get(key)
+>>> if info is None:
+...     info = run_mkvmerge_identify('/path/to/file.mkv')
+...     cache.put(key, info)
+"""
+
+import json
+import os
+from os.path import dirname, expanduser, join, realpath
+from shutil import which
+import threading
+import time
+
+
+def default_cache_path():
+    """Get the default path of the identify cache.
+
+    The path is taken from the $PYMKV_IDENTIFY_CACHE environment variable if it is set, otherwise the cache is
+    placed in the user's cache directory. An empty $PYMKV_IDENTIFY_CACHE disables the cache.
+
+    Returns
+    -------
+    str, None
+        The path of the database, or None if the cache is disabled.
+    """
+    if 'PYMKV_IDENTIFY_CACHE' in os.environ:
+        return os.environ['PYMKV_IDENTIFY_CACHE'] or None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(cache_home, 'pymkv', 'identify.sqlite3')
+
+
+class IdentifyCache:
+    """A persistent cache of `mkvmerge -J` results.
+
+    Every thread gets its own connection to the database. Any error raised by SQLite or by the filesystem disables
+    the cache for the rest of the process instead of failing the identification.
+
+    Parameters
+    ----------
+    db_path : str, optional
+        The path of the SQLite database. It is created if it does not exist. By default it is the path returned by
+        :func:`~pymkv.IdentifyCache.default_cache_path`, if that is None the cache is disabled.
+    max_entries : int, optional
+        The number of entries kept after an eviction. The least recently used entries are evicted first.
+    max_age : float, optional
+        The number of seconds after which an entry that has not been used is evicted.
+    """
+
+    # Refresh the access time of an entry at most once per this many seconds, so that cache hits do not turn every
+    # lookup into a write contended by the other processes.
+    _touch_interval = 24 * 3600
+    # Evict once every this many insertions.
+    _evict_interval = 256
+
+    def __init__(self, db_path=None, max_entries=100_000, max_age=90 * 24 * 3600):
+        if db_path is None:
+            db_path = default_cache_path()
+        self.db_path = expanduser(db_path) if db_path is not None else None
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mkvmerge_ids = {}
+        self._puts = 0
+        self._disabled = self.db_path is None
+
+    def __repr__(self):
+        return repr(self.__dict__)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # A forked child must not reuse the connection of its parent.
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        import sqlite3
+        os.makedirs(dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS identify ('
+                     'path TEXT NOT NULL, mkvmerge TEXT NOT NULL, size INTEGER NOT NULL, '
+                     'mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, info TEXT NOT NULL, '
+                     'accessed REAL NOT NULL, PRIMARY KEY (path, mkvmerge)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS identify_accessed ON identify (accessed)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _mkvmerge_id(self, mkvmerge_path):
+        # The resolved executable with its size and modification time identifies the mkvmerge version without
+        # spawning `mkvmerge --version` in every process.
+        if mkvmerge_path not in self._mkvmerge_ids:
+            executable = which(mkvmerge_path)
+            if executable is None:
+                return None
+            executable = realpath(executable)
+            stat = os.stat(executable)
+            self._mkvmerge_ids[mkvmerge_path] = f'{executable}:{stat.st_size}:{stat.st_mtime_ns}'
+        return self._mkvmerge_ids[mkvmerge_path]
+
+    def key(self, file_path, mkvmerge_path='mkvmerge'):
+        """Get the cache key of a file.
+
+        The key must be computed before running mkvmerge, so that a file modified while it is being identified is
+        stored under its old key and identified again the next time.
+
+        Parameters
+        ----------
+        file_path : str
+            The path of the file.
+        mkvmerge_path : str, optional
+            The path of the mkvmerge executable used to identify the file.
+
+        Returns
+        -------
+        tuple, None
+            The key of the file, or None if the file or mkvmerge could not be found.
+        """
+        if self._disabled:
+            return None
+        try:
+            mkvmerge_id = self._mkvmerge_id(mkvmerge_path)
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if mkvmerge_id is None:
+            return None
+        return realpath(file_path), mkvmerge_id, stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, key):
+        """Get the identification of a file.
+
+        Parameters
+        ----------
+        key : tuple
+            The key returned by :meth:`~pymkv.IdentifyCache.key`.
+
+        Returns
+        -------
+        dict, None
+            The output of `mkvmerge -J`, or None if it is not cached.
+        """
+        if key is None or self._disabled:
+            return None
+        import sqlite3 # not imported with the module, many runs never need the cache
+        path, mkvmerge_id, size, mtime_ns, inode = key
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT info, accessed FROM identify '
+                               'WHERE path = ? AND mkvmerge = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                               (path, mkvmerge_id, size, mtime_ns, inode)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self._touch_interval:
+                conn.execute('UPDATE identify SET accessed = ? WHERE path = ? AND mkvmerge = ?',
+                             (now, path, mkvmerge_id))
+        except (sqlite3.Error, OSError):
+            self._disabled = True
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, info):
+        """Store the identification of a file.
+
+        Parameters
+        ----------
+        key : tuple
+            The key returned by :meth:`~pymkv.IdentifyCache.key`.
+        info : dict
+            The output of `mkvmerge -J`.
+        """
+        if key is None or self._disabled:
+            return
+        import sqlite3
+        path, mkvmerge_id, size, mtime_ns, inode = key
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self._evict_interval == 1
+        try:
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO identify VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (path, mkvmerge_id, size, mtime_ns, inode, json.dumps(info), time.time()))
+            if evict:
+                self.evict()
+        except (sqlite3.Error, OSError):
+            self._disabled = True
+
+    def evict(self):
+        """Remove the entries older than `max_age` and the least recently used ones beyond `max_entries`."""
+        if self._disabled:
+            return
+        import sqlite3
+        try:
+            conn = self._connection()
+            conn.execute('DELETE FROM identify WHERE accessed < ?', (time.time() - self.max_age,))
+            conn.execute('DELETE FROM identify WHERE (path, mkvmerge) IN ('
+                         'SELECT path, mkvmerge FROM identify ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+        except (sqlite3.Error, OSError):
+            self._disabled = True
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        if self._disabled:
+            return
+        import sqlite3
+        try:
+            self._connection().execute('DELETE FROM identify')
+        except (sqlite3.Error, OSError):
+            self._disabled = True
@@ -24,7 +24,6 @@ Now, the MKV can be muxed with both attachments.
 """
 
 from os.path import expanduser, isfile
-from mimetypes import guess_type
 
 
 class MKVAttachment:
@@ -82,6 +81,7 @@ class MKVAttachment:
         file_path = expanduser(file_path)
         if not isfile(file_path):
             raise FileNotFoundError(f'"{file_path}" does not exist')
+        from mimetypes import guess_type # slow to import, attachments are rarely used
         self.mime_type = guess_type(file_path)[0]
         self.name = None
         self._file_path = file_path
@@ -35,16 +35,17 @@ Combine two MKVs. This example takes two existing MKVs and combines their tracks
 >>> mkv1.mux('/path/to/output.mkv')
 """
 
-import json
-from os import devnull
 from os.path import expanduser, isfile
 import subprocess as sp
 
+from .FileInfo import FileInfo
 from .MKVTrack import MKVTrack
 from .MKVAttachment import MKVAttachment
 from .Timestamp import Timestamp
 from .ISO639_2 import ISO639_2_languages
-from .Verifications import verify_matroska, verify_mkvmerge
+from .Metrics import mkvmerge_invocations
+from .Progress import ProgressEvent, iter_events
+from .Verifications import _identify_file, verify_matroska, verify_mkvmerge
 
 
 class MKVFile:
@@ -74,6 +75,9 @@ class MKVFile:
         The path where pymkv looks for the mkvmerge executable. pymkv relies on the mkvmerge executable to parse
         files. By default, it is assumed mkvmerge is in your shell's $PATH variable. If it is not, you need to set
         *mkvmerge_path* to the executable location.
+    info : dict or :class:`~pymkv.FileInfo.FileInfo`, optional
+        The output of `mkvmerge -J` for `file_path`, or its record, if it has already been identified. When it is
+        passed, neither the file nor its tracks are identified again.
 
     Raises
     ------
@@ -81,7 +85,7 @@ class MKVFile:
         Raised if the path to mkvmerge could not be verified.
     """
 
-    def __init__(self, file_path=None, title=None, mkvmerge_path='mkvmerge'):
+    def __init__(self, file_path=None, title=None, mkvmerge_path='mkvmerge', info=None):
         self.mkvmerge_path = mkvmerge_path
         self.title = title
         self._chapters_file = None
@@ -98,23 +102,26 @@ class MKVFile:
                                     'the mkvmerge_path property')
         if file_path is not None:
             file_path = expanduser(file_path)
-            info = json.loads(sp.check_output([self.mkvmerge_path, '-J', file_path]).decode())
-            if info['container']['recognized'] is True and info['container']['supported'] is True:
+            if info is None:
+                info = _identify_file(file_path, self.mkvmerge_path, False, 'MKVFile.__init__')
+            # the tracks share the record of the file
+            info = FileInfo.from_info(info)
+            if info.recognized is True and info.supported is True:
                 # add file title
-                if self.title is None and 'title' in info['container']['properties']:
-                    self.title = info['container']['properties']['title']
+                if self.title is None and info.title is not None:
+                    self.title = info.title
 
                 # add tracks with info
-                for track in info['tracks']:
-                    new_track = MKVTrack(file_path, track_id=track['id'], mkvmerge_path=mkvmerge_path)
-                    if 'track_name' in track['properties']:
-                        new_track.track_name = track['properties']['track_name']
-                    if 'language' in track['properties']:
-                        new_track.language = track['properties']['language']
-                    if 'default_track' in track['properties']:
-                        new_track.default_track = track['properties']['default_track']
-                    if 'forced_track' in track['properties']:
-                        new_track.forced_track = track['properties']['forced_track']
+                for track in info.tracks:
+                    new_track = MKVTrack(file_path, track_id=track.id, mkvmerge_path=mkvmerge_path, info=info)
+                    if track.track_name is not None:
+                        new_track.track_name = track.track_name
+                    if track.language is not None:
+                        new_track.language = track.language
+                    if track.default_track is not None:
+                        new_track.default_track = track.default_track
+                    if track.forced_track is not None:
+                        new_track.forced_track = track.forced_track
                     self.add_track(new_track)
 
     def __repr__(self):
@@ -140,6 +147,9 @@ class MKVFile:
     def command(self, output_path, subprocess=False):
         """Generates an mkvmerge command based on the configured :class:`~pymkv.MKVFile`.
 
+        The tracks coming from the same file are passed to mkvmerge as a single input, so that the file is read only
+        once, and `--track-order` keeps them in the order of :attr:`~pymkv.MKVFile.tracks`.
+
         Parameters
         ----------
         output_path : str
@@ -158,50 +168,65 @@ class MKVFile:
         command = [self.mkvmerge_path, '-o', output_path]
         if self.title is not None:
             command.extend(['--title', self.title])
-        # add tracks
+        # group the tracks by file, so that every file is an input read only once by mkvmerge
+        inputs = []
+        track_order = []
         for track in self.tracks:
-            # flags
-            if track.track_name is not None:
-                command.extend(['--track-name', str(track.track_id) + ':' + track.track_name])
-            if track.language is not None:
-                command.extend(['--language', str(track.track_id) + ':' + track.language])
-            if track.tags is not None:
-                command.extend(['--tags', str(track.track_id) + ':' + track.tags])
-            if track.default_track:
-                command.extend(['--default-track', str(track.track_id) + ':1'])
-            else:
-                command.extend(['--default-track', str(track.track_id) + ':0'])
-            if track.forced_track:
-                command.extend(['--forced-track', str(track.track_id) + ':1'])
+            # the exclusions apply to a whole input, as does every track id to a single track
+            key = (track.file_path, track.no_chapters, track.no_global_tags, track.no_track_tags,
+                   track.no_attachments)
+            for file_id, (input_key, input_tracks) in enumerate(inputs):
+                if input_key == key and all(other.track_id != track.track_id for other in input_tracks):
+                    input_tracks.append(track)
+                    break
             else:
-                command.extend(['--forced-track', str(track.track_id) + ':0'])
+                file_id = len(inputs)
+                inputs.append((key, [track]))
+            track_order.append(f'{file_id}:{track.track_id}')
+
+        # add tracks
+        for (file_path, no_chapters, no_global_tags, no_track_tags, no_attachments), input_tracks in inputs:
+            # flags
+            for track in input_tracks:
+                if track.track_name is not None:
+                    command.extend(['--track-name', str(track.track_id) + ':' + track.track_name])
+                if track.language is not None:
+                    command.extend(['--language', str(track.track_id) + ':' + track.language])
+                if track.tags is not None:
+                    command.extend(['--tags', str(track.track_id) + ':' + track.tags])
+                if track.default_track:
+                    command.extend(['--default-track', str(track.track_id) + ':1'])
+                else:
+                    command.extend(['--default-track', str(track.track_id) + ':0'])
+                if track.forced_track:
+                    command.extend(['--forced-track', str(track.track_id) + ':1'])
+                else:
+                    command.extend(['--forced-track', str(track.track_id) + ':0'])
 
             # remove extra tracks
-            if track.track_type != 'video':
-                command.append('-D')
-            else:
-                command.extend(['-d', str(track.track_id)])
-            if track.track_type != 'audio':
-                command.append('-A')
-            else:
-                command.extend(['-a', str(track.track_id)])
-            if track.track_type != 'subtitles':
-                command.append('-S')
-            else:
-                command.extend(['-s', str(track.track_id)])
+            for track_type, keep, remove in (('video', '-d', '-D'), ('audio', '-a', '-A'), ('subtitles', '-s', '-S')):
+                track_ids = [str(track.track_id) for track in input_tracks if track.track_type == track_type]
+                if track_ids:
+                    command.extend([keep, ','.join(track_ids)])
+                else:
+                    command.append(remove)
 
             # exclusions
-            if track.no_chapters:
+            if no_chapters:
                 command.append('--no-chapters')
-            if track.no_global_tags:
+            if no_global_tags:
                 command.append('--no-global-tags')
-            if track.no_track_tags:
+            if no_track_tags:
                 command.append('--no-track-tags')
-            if track.no_attachments:
+            if no_attachments:
                 command.append('--no-attachments')
 
             # add path
-            command.append(track.file_path)
+            command.append(file_path)
+
+        # keep the order of the tracks, not the one of the inputs
+        if track_order:
+            command.extend(['--track-order', ','.join(track_order)])
 
         # add attachments
         for attachment in self.attachments:
@@ -242,31 +267,45 @@ class MKVFile:
             return command
         return " ".join(command)
 
-    def mux(self, output_path, silent=False):
+    def mux(self, output_path, silent=False, progress=None):
         """Muxes the specified :class:`~pymkv.MKVFile`.
 
+        The output of mkvmerge is parsed as it is printed, with :func:`~pymkv.Progress.iter_events`, so that it is
+        never held in memory.
+
         Parameters
         ----------
         output_path : str
             The path to be used as the output file in the mkvmerge command.
         silent : bool, optional
-            By default the mkvmerge output will be shown unless silent is True.
+            By default the mkvmerge command will be shown unless silent is True.
+        progress : callable, optional
+            Called with every :class:`~pymkv.Progress.ProgressEvent`, :class:`~pymkv.Progress.WarningEvent` and
+            :class:`~pymkv.Progress.ErrorEvent` reported by mkvmerge.
 
         Raises
         ------
         FileNotFoundError
             Raised if the path to mkvmerge could not be verified.
+        subprocess.CalledProcessError
+            Raised if mkvmerge failed or reported warnings, its output being the warnings and the errors reported.
         """
         if not verify_mkvmerge(mkvmerge_path=self.mkvmerge_path):
             raise FileNotFoundError('mkvmerge is not at the specified path, add it there or change the mkvmerge_path '
                                     'property')
         output_path = expanduser(output_path)
-        if silent:
-            sp.run(self.command(output_path, subprocess=True), stdout=open(devnull, 'wb'), check=True)
-        else:
-            command = self.command(output_path)
-            print('Running with command:\n"' + command + '"')
-            sp.run(self.command(output_path, subprocess=True), check=True, capture_output=True)
+        command = self.command(output_path, subprocess=True)
+        if not silent:
+            print('Running with command:\n"' + ' '.join(command) + '"')
+        command.insert(1, '--gui-mode')
+        mkvmerge_invocations.inc(site='mux')
+        messages = []
+        with sp.Popen(command, stdout=sp.PIPE, text=True, bufsize=1) as process:
+            for event in iter_events(process.stdout, progress):
+                if not isinstance(event, ProgressEvent):
+                    messages.append(str(event))
+        if process.returncode != 0:
+            raise sp.CalledProcessError(process.returncode, command, output='\n'.join(messages))
 
     def add_file(self, file):
         """Add an MKV file into the :class:`~pymkv.MKVFile` object.
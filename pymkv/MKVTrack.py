@@ -35,11 +35,10 @@ Now all these tracks can be added to an :class:`~pymkv.MKVFile` object and muxed
 >>> file.mux('path/to/output.mkv')
 """
 
-import json
 from os.path import expanduser, isfile
-import subprocess as sp
 
-from .Verifications import verify_supported
+from .FileInfo import FileInfo
+from .Verifications import _identify_file
 from .ISO639_2 import ISO639_2_languages
 
 
@@ -71,6 +70,9 @@ class MKVTrack:
         The path where pymkv looks for the mkvmerge executable. pymkv relies on the mkvmerge executable to parse
         files. By default, it is assumed mkvmerge is in your shell's $PATH variable. If it is not, you need to set
         *mkvmerge_path* to the executable location.
+    info : dict or :class:`~pymkv.FileInfo.FileInfo`, optional
+        The output of `mkvmerge -J` for `file_path`, or its record, if it has already been identified. When it is
+        passed, the file is not identified again.
 
     Attributes
     ----------
@@ -98,18 +100,29 @@ class MKVTrack:
         If attachments exist in the track file, don't include them when this :class:`~pymkv.MKVTrack` object is a track
         in an :class:`~pymkv.MKVFile` mux operation. This option has no effect on standalone track files, only tracks
         that are already part of an MKV file.
+
+    Notes
+    -----
+    The attributes are slots, and the codec and the type of the track are read from the
+    :class:`~pymkv.FileInfo.FileInfo` of its file, shared by every track of the file, so that planning the muxes of
+    large libraries stays cheap in memory.
     """
 
-    def __init__(self, file_path, track_id=0, track_name=None, language=None, default_track=False, forced_track=False, mkvmerge_path='mkvmerge'):
+    __slots__ = ('_file_info', 'mkvmerge_path', '_file_path', '_track_id', 'track_name', '_language', '_tags',
+                 'default_track', 'forced_track', 'no_chapters', 'no_global_tags', 'no_track_tags', 'no_attachments')
+
+    def __init__(self, file_path, track_id=0, track_name=None, language=None, default_track=False, forced_track=False, mkvmerge_path='mkvmerge', info=None):
         # track info
-        self._track_codec = None
-        self._track_type = None
+        self._file_info = None
 
         # base
         self.mkvmerge_path = mkvmerge_path
         self._file_path = None
-        self.file_path = file_path
         self._track_id = None
+        if info is None:
+            self.file_path = file_path
+        else:
+            self._set_file_path(expanduser(file_path), info)
         self.track_id = track_id
 
         # flags
@@ -127,7 +140,7 @@ class MKVTrack:
         self.no_attachments = False
 
     def __repr__(self):
-        return repr(self.__dict__)
+        return repr({name: getattr(self, name) for name in self.__slots__})
 
     @property
     def file_path(self):
@@ -146,9 +159,14 @@ class MKVTrack:
     @file_path.setter
     def file_path(self, file_path):
         file_path = expanduser(file_path)
-        if not verify_supported(file_path, mkvmerge_path=self.mkvmerge_path):
-            raise ValueError('"{}" is not a supported file')
+        self._set_file_path(file_path, _identify_file(file_path, self.mkvmerge_path, False, 'MKVTrack'))
+
+    def _set_file_path(self, file_path, info):
+        info = FileInfo.from_info(info)
+        if not info.supported:
+            raise ValueError(f'"{file_path}" is not a supported file')
         self._file_path = file_path
+        self._file_info = info
         self.track_id = 0
 
     @property
@@ -167,12 +185,9 @@ class MKVTrack:
 
     @track_id.setter
     def track_id(self, track_id):
-        info_json = json.loads(sp.check_output([self.mkvmerge_path, '-J', self.file_path]).decode())
-        if not 0 <= track_id < len(info_json['tracks']):
+        if not 0 <= track_id < len(self._file_info.tracks):
             raise IndexError('track index out of range')
         self._track_id = track_id
-        self._track_codec = info_json['tracks'][track_id]['codec']
-        self._track_type = info_json['tracks'][track_id]['type']
 
     @property
     def language(self):
@@ -222,9 +237,9 @@ class MKVTrack:
     @property
     def track_codec(self):
         """str: The codec of the track such as h264 or AAC."""
-        return self._track_codec
+        return self._file_info.tracks[self._track_id].codec
 
     @property
     def track_type(self):
         """str: The type of track such as video or audio."""
-        return self._track_type
+        return self._file_info.tracks[self._track_id].type
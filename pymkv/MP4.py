@@ -0,0 +1,254 @@
+"""A minimal reader of the box structure of QuickTime/MP4 files, used to identify them without running mkvmerge.
+
+The top-level boxes are walked by seeking over their payloads, so the media data is never read whether the `moov`
+box is placed before or after it, then the `trak` boxes are read to build the list of tracks.
+:func:`~pymkv.MP4.probe_mp4` returns the same fields pymkv takes from `mkvmerge -J`, and None for anything it cannot
+decode with certainty, so that the caller can fall back to mkvmerge.
+
+Examples
+--------
+>>> from pymkv.MP4 import probe_mp4
+>>> info = probe_mp4('path/to/file.mp4')
+>>> if info is None:
+...     info = identify_file('path/to/file.mp4')
+"""
+
+from os import fstat
+
+# Largest `moov` box read in memory, larger ones are left to mkvmerge.
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+# Number of top-level boxes looked at before giving up.
+MAX_TOP_LEVEL_BOXES = 1024
+
+HANDLER_TYPES = {
+    b'vide': 'video',
+    b'soun': 'audio',
+    b'sbtl': 'subtitles',
+    b'subt': 'subtitles',
+    b'text': 'subtitles',
+}
+
+# The codec names mkvmerge reports for the most common sample entries. Any other one is left to mkvmerge.
+CODECS = {
+    b'avc1': 'AVC/H.264/MPEG-4p10',
+    b'avc3': 'AVC/H.264/MPEG-4p10',
+    b'hvc1': 'HEVC/H.265/MPEG-H',
+    b'hev1': 'HEVC/H.265/MPEG-H',
+    b'av01': 'AV1',
+    b'vp09': 'VP9',
+    b'ac-3': 'AC-3',
+    b'ec-3': 'E-AC-3',
+    b'Opus': 'Opus',
+    b'fLaC': 'FLAC',
+    b'tx3g': 'Timed Text',
+}
+
+# The codec names of the MPEG-4 audio sample entries, by object type indication of their decoder configuration.
+MPEG4_AUDIO_CODECS = {
+    0x40: 'AAC',
+    0x66: 'AAC',
+    0x67: 'AAC',
+    0x68: 'AAC',
+    0x69: 'MP3',
+    0x6B: 'MP3',
+}
+
+
+def iter_boxes(data, pos=0, end=None):
+    """Iterate over the boxes contained in `data`.
+
+    Yields
+    ------
+    tuple
+        The type of every box, the position of its payload and the position of its end.
+    """
+    end = len(data) if end is None else end
+    while pos + 8 <= end:
+        size = int.from_bytes(data[pos:pos + 4], 'big')
+        box_type = data[pos + 4:pos + 8]
+        start = pos + 8
+        if size == 1:
+            size = int.from_bytes(data[start:start + 8], 'big')
+            start += 8
+        elif size == 0: # the box extends up to the end of its parent
+            size = end - pos
+        if size < start - pos or pos + size > end:
+            raise ValueError('MP4 box overflows its parent')
+        yield box_type, start, pos + size
+        pos += size
+
+
+def find_box(data, start, end, *path):
+    """Find the first box following the box types in `path`, starting from the children of `data[start:end]`.
+
+    Returns
+    -------
+    tuple of int, None
+        The position of the payload of the box and the position of its end, or None if it does not exist.
+    """
+    for box_type, box_start, box_end in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return find_box(data, box_start, box_end, *path[1:])
+    return None
+
+
+def _read_descriptor_header(data, pos):
+    # The length of an MPEG-4 descriptor takes up to four bytes, each one but the last having its high bit set.
+    tag = data[pos]
+    length = 0
+    for _ in range(4):
+        pos += 1
+        length = (length << 7) | (data[pos] & 0x7F)
+        if not data[pos] & 0x80:
+            break
+    return tag, pos + 1, length
+
+
+def _mpeg4_audio_codec(data, start, end):
+    # The `esds` box follows the 28 bytes of a version 0 audio sample entry.
+    if int.from_bytes(data[start + 8:start + 10], 'big') != 0:
+        return None
+    esds = find_box(data, start + 28, end, b'esds')
+    if esds is None:
+        return None
+    tag, pos, _ = _read_descriptor_header(data, esds[0] + 4) # skip version and flags
+    if tag != 0x03: # ES_Descriptor
+        return None
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80: # streamDependenceFlag
+        pos += 2
+    if flags & 0x40: # URL_Flag
+        pos += 1 + data[pos]
+    if flags & 0x20: # OCRstreamFlag
+        pos += 2
+    tag, pos, _ = _read_descriptor_header(data, pos)
+    if tag != 0x04: # DecoderConfigDescriptor
+        return None
+    return MPEG4_AUDIO_CODECS.get(data[pos])
+
+
+def _parse_language(code):
+    # ISO 639-2/T code packed in three 5-bit characters, lower values are Macintosh language codes.
+    if code < 0x400 or code == 0x7FFF:
+        return 'und'
+    return ''.join(chr(((code >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+
+
+def _parse_trak(data, start, end):
+    tkhd = find_box(data, start, end, b'tkhd')
+    mdhd = find_box(data, start, end, b'mdia', b'mdhd')
+    hdlr = find_box(data, start, end, b'mdia', b'hdlr')
+    stsd = find_box(data, start, end, b'mdia', b'minf', b'stbl', b'stsd')
+    if None in (tkhd, mdhd, hdlr, stsd):
+        raise ValueError('incomplete MP4 track')
+
+    tkhd_start = tkhd[0]
+    flags = int.from_bytes(data[tkhd_start + 1:tkhd_start + 4], 'big')
+    track_id_offset = 20 if data[tkhd_start] == 1 else 12
+    number = int.from_bytes(data[tkhd_start + track_id_offset:tkhd_start + track_id_offset + 4], 'big')
+
+    mdhd_start = mdhd[0]
+    language_offset = 32 if data[mdhd_start] == 1 else 20
+    language = _parse_language(int.from_bytes(data[mdhd_start + language_offset:mdhd_start + language_offset + 2],
+                                              'big'))
+
+    track_type = HANDLER_TYPES.get(data[hdlr[0] + 8:hdlr[0] + 12])
+
+    # The first sample entry follows the version, the flags and the entry count.
+    entries = iter_boxes(data, stsd[0] + 8, stsd[1])
+    entry_type, entry_start, entry_end = next(entries)
+    if entry_type == b'mp4a':
+        codec = _mpeg4_audio_codec(data, entry_start, entry_end)
+    else:
+        codec = CODECS.get(entry_type)
+    if track_type is None or codec is None:
+        raise ValueError('unsupported MP4 track')
+
+    properties = {
+        'codec_id': entry_type.decode('latin-1'),
+        'default_track': bool(flags & 0x1),
+        'enabled_track': bool(flags & 0x1),
+        'forced_track': False,
+        'language': language,
+        'number': number,
+    }
+    name = find_box(data, start, end, b'udta', b'name')
+    if name is not None:
+        properties['track_name'] = data[name[0]:name[1]].rstrip(b'\0').decode()
+    return {
+        'type': track_type,
+        'codec': codec,
+        'properties': properties,
+    }
+
+
+def probe_mp4(file_path):
+    """Identify a QuickTime/MP4 file by reading its `moov` box.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file to be identified.
+
+    Returns
+    -------
+    dict, None
+        The fields of `mkvmerge -J <file_path>` used by pymkv, or None if `file_path` is not an MP4 file or could not
+        be decoded.
+    """
+    try:
+        with open(file_path, 'rb', buffering=0) as file:
+            return _probe_mp4(file)
+    except (OSError, ValueError, IndexError, StopIteration, UnicodeDecodeError):
+        return None
+
+
+def _probe_mp4(file):
+    file_size = fstat(file.fileno()).st_size
+    pos = 0
+    for index in range(MAX_TOP_LEVEL_BOXES):
+        if pos + 8 > file_size:
+            return None
+        file.seek(pos)
+        header = file.read(16)
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8]
+        header_size = 8
+        if size == 1:
+            size = int.from_bytes(header[8:16], 'big')
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            return None
+        if index == 0 and box_type != b'ftyp':
+            return None
+        if box_type == b'moov':
+            break
+        pos += size
+    else:
+        return None
+
+    if size > MAX_MOOV_SIZE or pos + size > file_size:
+        return None
+    file.seek(pos + header_size)
+    moov = file.read(size - header_size)
+
+    tracks = []
+    for box_type, start, end in iter_boxes(moov):
+        if box_type == b'cmov': # compressed movie header
+            return None
+        if box_type == b'trak':
+            tracks.append({'id': len(tracks), **_parse_trak(moov, start, end)})
+    return {
+        'container': {
+            'properties': {},
+            'recognized': True,
+            'supported': True,
+            'type': 'QuickTime/MP4',
+        },
+        'tracks': tracks,
+    }
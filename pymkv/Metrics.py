@@ -0,0 +1,223 @@
+"""Counters and histograms of the work done by pymkv and by its users, exported in the Prometheus text format.
+
+pymkv records in :data:`~pymkv.Metrics.metrics` every mkvmerge process it spawns, by call site, and how long every
+identification took, by method. Applications can register their own metrics in the same registry, then write all of
+them to a file read by the textfile collector of the Prometheus node exporter at the end of a run.
+
+Examples
+--------
+>>> from pymkv import metrics
+>>> jobs = metrics.counter('myapp_jobs_total', 'Jobs done, by status.', ['status'])
+>>> jobs.inc(status='done')
+>>> metrics.counter('pymkv_mkvmerge_invocations_total').value(site='identify_file')
+0
+>>> metrics.write_textfile('/var/lib/node_exporter/myapp.prom')
+"""
+
+from os import getpid, replace, unlink
+from threading import Lock
+import time
+
+# Upper bounds of the buckets of the histograms of durations, in seconds.
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+# Upper bounds of the buckets of the histograms of sizes, in bytes.
+SIZE_BUCKETS = tuple(2 ** exponent for exponent in range(20, 38, 2)) # 1 MiB to 64 GiB
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values = {} # tuple of label values -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, not {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """Remove every value recorded."""
+        with self._lock:
+            self._values.clear()
+
+    def exposition(self):
+        """Return the metric in the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(dict(zip(self.labelnames, key)), value))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """A count that only goes up, e.g. of processes spawned."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add `amount` to the count of `labels`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the count of `labels`."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self, labels, value):
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, e.g. durations, counted in buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Record `value` in the distribution of `labels`."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Return a context manager observing the time spent in its block, in seconds."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        """Return the number of values observed for `labels`."""
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ((), 0))
+            return sum(counts)
+
+    def sum(self, **labels):
+        """Return the sum of the values observed for `labels`."""
+        with self._lock:
+            return self._values.get(self._key(labels), ((), 0))[1]
+
+    def _samples(self, labels, value):
+        counts, total = value
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            samples.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} {cumulative}')
+        samples.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+        samples.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """A set of metrics, identified by their names."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                if help is None:
+                    raise KeyError(f'no metric named {name}')
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {metric.type}')
+            return metric
+
+    def counter(self, name, help=None, labelnames=()):
+        """Return the counter `name`, registering it if `help` is given.
+
+        Parameters
+        ----------
+        name : str
+            The name of the counter, e.g. `pymkv_mkvmerge_invocations_total`.
+        help : str, optional
+            The description of the counter.
+        labelnames : list of str, optional
+            The names of the labels of the counter.
+        """
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help=None, labelnames=(), buckets=DURATION_BUCKETS):
+        """Return the histogram `name`, registering it with `buckets` if `help` is given."""
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def clear(self):
+        """Remove every value recorded by the metrics, keeping them registered."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def exposition(self):
+        """Return all the metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return ''.join(metric.exposition() for metric in metrics)
+
+    def write_textfile(self, path):
+        """Write all the metrics to `path` in the Prometheus text format.
+
+        The file is replaced atomically, so that the textfile collector of the node exporter never reads it half
+        written.
+        """
+        temporary_path = f'{path}.{getpid()}.tmp'
+        try:
+            with open(temporary_path, 'w') as file:
+                file.write(self.exposition())
+            replace(temporary_path, path)
+        except BaseException:
+            try:
+                unlink(temporary_path)
+            except OSError:
+                pass
+            raise
+
+
+# The registry of the metrics of pymkv, shared with its users.
+metrics = Registry()
+
+mkvmerge_invocations = metrics.counter('pymkv_mkvmerge_invocations_total',
+                                       'mkvmerge processes spawned, by call site.', ['site'])
+identify_seconds = metrics.histogram('pymkv_identify_seconds',
+                                     'Time spent identifying a file, by method: native, cache or mkvmerge.',
+                                     ['method'])
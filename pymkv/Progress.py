@@ -0,0 +1,97 @@
+"""A streaming parser of the output of `mkvmerge --gui-mode`, turning its lines into typed events.
+
+mkvmerge run with `--gui-mode` prints its progress as `#GUI#progress N%` lines and its warnings and errors as
+`#GUI#warning` and `#GUI#error` lines, without translating them. :func:`~pymkv.Progress.iter_events` reads them
+lazily, one line at a time, so that the output of a long mux is never held in memory.
+
+Examples
+--------
+>>> from subprocess import PIPE, Popen
+>>> from pymkv.Progress import ProgressEvent, iter_events
+>>> process = Popen(['mkvmerge', '--gui-mode', '-o', 'out.mkv', 'in.mkv'], stdout=PIPE, text=True)
+>>> for event in iter_events(process.stdout):
+...     if isinstance(event, ProgressEvent):
+...         print(f'{event.percentage}%')
+...     else:
+...         print(event)
+"""
+
+from collections import namedtuple
+
+
+class ProgressEvent(namedtuple('ProgressEvent', ['percentage'])):
+    """The percentage of the mux done, from 0 to 100."""
+    __slots__ = ()
+
+    def __str__(self):
+        return f'Progress: {self.percentage}%'
+
+
+class WarningEvent(namedtuple('WarningEvent', ['message'])):
+    """A warning of mkvmerge, the mux goes on."""
+    __slots__ = ()
+
+    def __str__(self):
+        return f'Warning: {self.message}'
+
+
+class ErrorEvent(namedtuple('ErrorEvent', ['message'])):
+    """An error of mkvmerge, the mux fails."""
+    __slots__ = ()
+
+    def __str__(self):
+        return f'Error: {self.message}'
+
+
+def parse_line(line):
+    """Parse a line printed by `mkvmerge --gui-mode`.
+
+    Parameters
+    ----------
+    line : str
+        The line, with or without its line terminator.
+
+    Returns
+    -------
+    :class:`~pymkv.Progress.ProgressEvent`, :class:`~pymkv.Progress.WarningEvent`, \
+:class:`~pymkv.Progress.ErrorEvent`, None
+        The event reported by the line, or None if it does not report any.
+    """
+    if not line.startswith('#GUI#'):
+        return None
+    kind, _, value = line[5:].partition(' ')
+    value = value.strip()
+    if kind == 'progress':
+        try:
+            return ProgressEvent(int(value.rstrip('%')))
+        except ValueError:
+            return None
+    if kind == 'warning':
+        return WarningEvent(value)
+    if kind == 'error':
+        return ErrorEvent(value)
+    return None
+
+
+def iter_events(lines, callback=None):
+    """Iterate over the events reported by the lines printed by `mkvmerge --gui-mode`.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines, e.g. the stdout of the mkvmerge process opened in text mode.
+    callback : callable, optional
+        Called with every event, before it is yielded.
+
+    Yields
+    ------
+    :class:`~pymkv.Progress.ProgressEvent`, :class:`~pymkv.Progress.WarningEvent`, :class:`~pymkv.Progress.ErrorEvent`
+        The events, in the order of the lines.
+    """
+    for line in lines:
+        event = parse_line(line)
+        if event is None:
+            continue
+        if callback is not None:
+            callback(event)
+        yield event
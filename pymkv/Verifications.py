@@ -3,14 +3,51 @@
 
 """Verification functions for mkvmerge and associated files."""
 
+from importlib import import_module
 import json
 import os
-from os.path import expanduser, isfile
+from os.path import expanduser, isfile, splitext
 from pathlib import Path
 from re import match
 from shutil import which
 import subprocess as sp
+from time import perf_counter
 
+# `import pymkv` imports this module for identify_file, so the other submodules of pymkv are imported where they are
+# used: a run that identifies nothing does not pay for them.
+
+# The cache shared by every identification, disabled by default, see enable_identify_cache.
+identify_cache = None
+
+# The readers of the containers recognised by guess_container, used instead of mkvmerge, as the submodule of pymkv
+# defining them and their name.
+native_probes = {
+    'Matroska': ('EBML', 'probe_matroska'),
+    'QuickTime/MP4': ('MP4', 'probe_mp4'),
+    'SSA/ASS subtitles': ('ASS', 'probe_ass'),
+}
+
+# The extensions of the containers recognised by guess_container. A file whose first bytes and extension disagree is
+# left to mkvmerge.
+container_extensions = {
+    'Matroska': {'.mkv', '.mka', '.mks', '.mk3d', '.webm'},
+    'QuickTime/MP4': {'.mp4', '.m4v', '.m4a', '.mov', '.3gp', '.3g2'},
+    'SSA/ASS subtitles': {'.ass', '.ssa'},
+}
+
+def enable_identify_cache(db_path=None):
+    """Cache the identifications made by mkvmerge on disk, in an :class:`~pymkv.IdentifyCache.IdentifyCache`.
+
+    The cache is disabled by default, so that using pymkv writes nothing outside the files it is given. Setting
+    :data:`identify_cache` to None disables it again.
+
+    db_path (str):
+        Path of the SQLite database, by default the one returned by :func:`~pymkv.IdentifyCache.default_cache_path`.
+        If that is None, because $PYMKV_IDENTIFY_CACHE is empty, the cache stays disabled.
+    """
+    from .IdentifyCache import IdentifyCache
+    global identify_cache
+    identify_cache = IdentifyCache(db_path)
 
 def verify_mkvmerge(mkvmerge_path='mkvmerge'):
     """Verify mkvmerge is working.
@@ -20,17 +57,118 @@ def verify_mkvmerge(mkvmerge_path='mkvmerge'):
     """
     return which(mkvmerge_path) is not None
 
-def identify_file(file_path, mkvmerge_path='mkvmerge'):
-    """Get information about about the source file. Same as `mvkmerge -J <file_path>`."""
+def guess_container(file_path):
+    """Guess the container of a file from its first bytes and its extension.
+
+    Matroska files are recognised by their EBML magic number, QuickTime/MP4 files by their leading `ftyp` box and
+    SSA/ASS subtitles by their leading `[Script Info]` section, in any encoding with a byte order mark. The extension
+    of the file must be one of the :data:`container_extensions` of the container too, e.g. a `.txt` file starting
+    with `[Script Info]` is left to mkvmerge.
+
+    file_path (str):
+        Path of the file to be classified.
+
+    Returns the container type, as named by mkvmerge, or None if the file has to be identified by mkvmerge.
+    """
+    container = _sniff_container(file_path)
+    if container is None or splitext(file_path)[1].lower() not in container_extensions[container]:
+        return None
+    return container
+
+def _sniff_container(file_path):
+    try:
+        with open(file_path, 'rb') as file:
+            data = file.read(256)
+    except OSError:
+        return None
+    from .ASS import decode_header, is_ass_header
+    from .EBML import EBML_HEADER
+    if data[:4] == EBML_HEADER.to_bytes(4, 'big'):
+        return 'Matroska'
+    if data[4:8] == b'ftyp':
+        return 'QuickTime/MP4'
+    if is_ass_header(decode_header(data)[0]):
+        return 'SSA/ASS subtitles'
+    return None
+
+def _cached_identification(file_path, mkvmerge_path, strict=False):
+    # Return the cache key of `file_path` and its identification, if it can be read from the file headers or the
+    # cache.
     if not isinstance(file_path, (str, os.PathLike)):
         raise TypeError(f'"{file_path}" is not of type str or os.PathLike')
     if not isfile(file_path):
         raise FileNotFoundError(f'"{file_path}" does not exist')
+    if not strict:
+        probe = native_probes.get(guess_container(file_path))
+        info = None
+        if probe is not None:
+            module, name = probe
+            info = getattr(import_module(f'.{module}', __package__), name)(file_path)
+        if info is not None:
+            return None, info
+    cache = identify_cache
+    if cache is None:
+        return None, None
+    key = cache.key(file_path, mkvmerge_path)
+    return key, cache.get(key)
+
+def _cache_identification(key, info):
+    cache = identify_cache
+    if cache is not None and key is not None:
+        cache.put(key, info)
+    return info
+
+def identify_file(file_path, mkvmerge_path='mkvmerge', strict=False):
+    """Get information about about the source file. Same as `mvkmerge -J <file_path>`.
+
+    The files recognised by :func:`guess_container` are identified by reading their headers with
+    :func:`~pymkv.EBML.probe_matroska`, :func:`~pymkv.MP4.probe_mp4` or :func:`~pymkv.ASS.probe_ass`. Other files,
+    or the ones they cannot decode, are looked up in :data:`identify_cache`, mkvmerge is run only if they are not
+    cached. If `strict` is True, mkvmerge identifies every file.
+    """
+    return _identify_file(file_path, mkvmerge_path, strict, 'identify_file')
+
+def _identify_file(file_path, mkvmerge_path, strict, site):
+    # `site` names the caller in the count of the mkvmerge processes spawned.
+    from .Metrics import identify_seconds, mkvmerge_invocations
+    start = perf_counter()
+    key, info = _cached_identification(file_path, mkvmerge_path, strict)
+    if info is not None:
+        identify_seconds.observe(perf_counter() - start, method='native' if key is None else 'cache')
+        return info
+    mkvmerge_invocations.inc(site=site)
     try:
         info = json.loads(sp.check_output([mkvmerge_path, '-J', file_path]).decode())
     except sp.CalledProcessError:
         raise ValueError(f'"{file_path}" could not be opened')
-    return info
+    identify_seconds.observe(perf_counter() - start, method='mkvmerge')
+    return _cache_identification(key, info)
+
+async def identify_file_async(file_path, mkvmerge_path='mkvmerge', strict=False):
+    """Same as :func:`identify_file`, but mkvmerge is run without blocking the event loop.
+
+    The headers and the cache are read in a thread, since they can block, e.g. on network storage or while another
+    process holds the lock of the cache. If the task is cancelled, mkvmerge is killed.
+    """
+    import asyncio # only needed by the users of the event loop, and slow to import
+    from .Metrics import identify_seconds, mkvmerge_invocations
+    start = perf_counter()
+    key, info = await asyncio.to_thread(_cached_identification, file_path, mkvmerge_path, strict)
+    if info is not None:
+        identify_seconds.observe(perf_counter() - start, method='native' if key is None else 'cache')
+        return info
+    mkvmerge_invocations.inc(site='identify_file_async')
+    process = await asyncio.create_subprocess_exec(mkvmerge_path, '-J', file_path, stdout=sp.PIPE)
+    try:
+        output, _ = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        raise ValueError(f'"{file_path}" could not be opened')
+    identify_seconds.observe(perf_counter() - start, method='mkvmerge')
+    return await asyncio.to_thread(_cache_identification, key, json.loads(output.decode()))
 
 def verify_matroska(file_path, mkvmerge_path='mkvmerge'):
     """Verify if a file is a Matroska file.
@@ -56,13 +194,15 @@ def verify_recognized(file_path, mkvmerge_path='mkvmerge'):
     return info['container']['recognized']
 
 
-def verify_supported(file_path, mkvmerge_path='mkvmerge'):
+def verify_supported(file_path, mkvmerge_path='mkvmerge', strict=False):
     """Verify a file is supported by mkvmerge.
 
     file_path (str):
         Path to the file to be verified.
     mkvmerge_path (str):
         Alternate path to mkvmerge if it is not already in the $PATH variable.
+    strict (bool):
+        Always let mkvmerge identify the file, instead of reading the headers of the containers it recognises.
     """
-    info = info = identify_file(file_path, mkvmerge_path)
+    info = identify_file(file_path, mkvmerge_path, strict)
     return info['container']['supported']
@@ -1,10 +1,59 @@
 # sheldon woodward
 # august 5, 2019
 
-from .ISO639_2 import ISO639_2_languages
-from .MKVAttachment import MKVAttachment
-from .MKVTrack import MKVTrack
-from .MKVFile import MKVFile
-from .Timestamp import Timestamp
-from .Verifications import identify_file, verify_matroska, verify_mkvmerge, verify_recognized, \
-    verify_supported
+# The submodules are imported on first access of their names (PEP 562), so that importing pymkv only costs what is
+# actually used.
+
+from importlib import import_module
+import sys
+from types import ModuleType
+
+_submodules = {
+    'ISO639_2_languages': 'ISO639_2',
+    'FileInfo': 'FileInfo',
+    'TrackInfo': 'FileInfo',
+    'FontIndex': 'FontIndex',
+    'IdentifyCache': 'IdentifyCache',
+    'MKVAttachment': 'MKVAttachment',
+    'MKVTrack': 'MKVTrack',
+    'MKVFile': 'MKVFile',
+    'Timestamp': 'Timestamp',
+    'metrics': 'Metrics',
+    'ProgressEvent': 'Progress',
+    'WarningEvent': 'Progress',
+    'ErrorEvent': 'Progress',
+    'iter_events': 'Progress',
+    'enable_identify_cache': 'Verifications',
+    'guess_container': 'Verifications',
+    'identify_file': 'Verifications',
+    'identify_file_async': 'Verifications',
+    'verify_matroska': 'Verifications',
+    'verify_mkvmerge': 'Verifications',
+    'verify_recognized': 'Verifications',
+    'verify_supported': 'Verifications',
+}
+
+__all__ = list(_submodules)
+
+
+def __getattr__(name):
+    if name not in _submodules:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(f'.{_submodules[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+class _Package(ModuleType):
+    # Importing a submodule sets it as an attribute of the package, which would hide the class of the same name.
+    def __setattr__(self, name, value):
+        if isinstance(value, ModuleType) and _submodules.get(name) == name:
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
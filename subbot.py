@@ -1,133 +1,379 @@
-from os.path    import isfile, isdir
-from pathlib    import Path
+from codecs     import getincrementaldecoder
+from collections import deque, namedtuple
+from functools  import lru_cache, partial
+import json
+from os         import O_CREAT, O_EXCL, O_WRONLY, close, cpu_count, getpid, listdir, major, minor, open as osopen, \
+                       replace, stat, statvfs, unlink
+from os.path    import isfile, isdir, realpath
+from pathlib    import Path, PurePath
 import re
 from shutil     import which
 from signal     import SIGINT, signal
 from subprocess import PIPE, Popen
 from sys        import argv, stderr, stdout, exit as sysexit
+from threading  import Condition, Lock
+from time       import perf_counter
 from traceback  import print_exc
 
-from pymkv      import identify_file, ISO639_2_languages, MKVFile, MKVTrack
+from pymkv      import enable_identify_cache, identify_file, identify_file_async, ISO639_2_languages, metrics
+from pymkv.FileInfo import FileInfo
+from pymkv.Metrics import SIZE_BUCKETS, mkvmerge_invocations
+from pymkv.Progress import ErrorEvent, ProgressEvent, WarningEvent, iter_events, parse_line
+
+# `asyncio`, `argparse`, `concurrent.futures`, `hashlib` and the pymkv classes building the muxes are imported where
+# they are used, so that importing `subbot` does not pay for the parts its user does not run: `asyncio` alone takes
+# longer to import than all the rest of `subbot`, `argparse` and `concurrent.futures` about as long.
 
 MKVMERGE_PATH: str = 'mkvmerge' # Let shutil.which find the executable.
+# Number of files identified at the same time, most of the time is spent waiting for `mkvmerge`.
+PROBE_JOBS: int = cpu_count() or 1
+# Number of muxes run at the same time.
+JOBS: int = 1
+# Print a JSON record of every job instead of the output paths.
+JSON_OUTPUT: bool = False
+# Bytes left free on the filesystem of an output after the muxes running on it are done.
+HEADROOM: int = 0
+# Seconds between two checks of the free space by the muxes waiting for it.
+SPACE_POLL: float = 1.0
+
+planning_seconds = metrics.histogram('subbot_planning_seconds',
+                                     'Time spent identifying and matching the files of a batch.')
+mux_seconds = metrics.histogram('subbot_mux_seconds', 'Duration of the muxes, by return code of mkvmerge.',
+                                ['returncode'])
+output_bytes = metrics.histogram('subbot_output_bytes', 'Size of the outputs of the muxes.', buckets=SIZE_BUCKETS)
+jobs_total = metrics.counter('subbot_jobs_total', 'Jobs of the mux queue, by outcome.', ['outcome'])
+
+# Serialises the lines printed on stdout by concurrent muxes.
+stdout_lock = Lock()
 
 # Shut down gracefully in case of a SIGINT, without printing the traceback.
 def handle_sigint():
     stdout.flush()
     signal(SIGINT, lambda signalnum, stack_frame: sysexit(0))
 
-def make_mux_queue(args):
-    subtitles = set()
-    videos = set()
+# Return the type of `arg`, the `FileInfo` of its `mkvmerge -J` output, the diagnostic to print if it is skipped and
+# the time spent identifying it. The files whose type is evident from their first bytes are not identified by
+# `mkvmerge`, unless `strict` is True.
+# A file that cannot be identified is skipped with a diagnostic, so that it does not abort the whole batch.
+def classify_file(arg, strict=False):
+    if not isfile(arg):
+        return None, None, f"Unrecognised '{arg}', skipping...", 0.0
+    start = perf_counter()
+    try:
+        info = identify_file(arg, mkvmerge_path=MKVMERGE_PATH, strict=strict)
+    except (OSError, ValueError):
+        return None, None, f"Could not identify '{arg}' with `mkvmerge`, skipping...", perf_counter() - start
+    return (*classify_info(arg, info), perf_counter() - start)
 
-    for arg in args:
-        if not isfile(arg):
-            print(f"Unrecognised '{arg}', skipping...", file=stderr)
-            continue
-        container = identify_file(arg)['container']
-        if not container['recognized']:
-            print(f"Unrecognised container of '{arg}' by `mkvmerge`, skipping...", file=stderr)
-            continue
-        if not container['supported']:
-            print(f"Unsupported container of '{arg}' by `mkvmerge`, skipping...", file=stderr)
+async def classify_file_async(arg, strict=False):
+    import asyncio
+    if not await asyncio.to_thread(isfile, arg):
+        return None, None, f"Unrecognised '{arg}', skipping...", 0.0
+    start = perf_counter()
+    try:
+        info = await identify_file_async(arg, mkvmerge_path=MKVMERGE_PATH, strict=strict)
+    except (OSError, ValueError):
+        return None, None, f"Could not identify '{arg}' with `mkvmerge`, skipping...", perf_counter() - start
+    return (*classify_info(arg, info), perf_counter() - start)
+
+def classify_info(arg, info):
+    # Only the record of the identification is kept, the mux queue of a large library holds one per file.
+    info = FileInfo.from_info(info)
+    if not info.recognized:
+        return None, info, f"Unrecognised container of '{arg}' by `mkvmerge`, skipping..."
+    if not info.supported:
+        return None, info, f"Unsupported container of '{arg}' by `mkvmerge`, skipping..."
+    file_type = info.type
+    if file_type == 'SSA/ASS subtitles':
+        return 'subtitles', info, None
+    if file_type in {'Matroska', 'QuickTime/MP4'}:
+        return 'video', info, None
+    return None, info, f"Unsupported container of '{arg}' by `subbot`, skipping..."
+
+def make_mux_queue(args, probe_jobs=None, strict=False):
+    from concurrent.futures import ThreadPoolExecutor
+    start = perf_counter()
+    with planning_seconds.time(), ThreadPoolExecutor(max_workers=probe_jobs or PROBE_JOBS) as executor:
+        # `map` yields in the order of `args`, so the diagnostics are deterministic too.
+        mux_queue = match_files(args, executor.map(partial(classify_file, strict=strict), args))
+    return record_planning(mux_queue, start)
+
+async def make_mux_queue_async(args, probe_jobs=None, strict=False):
+    import asyncio
+    semaphore = asyncio.Semaphore(probe_jobs or PROBE_JOBS)
+    async def classify(arg):
+        async with semaphore:
+            return await classify_file_async(arg, strict)
+    start = perf_counter()
+    with planning_seconds.time():
+        mux_queue = match_files(args, await asyncio.gather(*map(classify, args)))
+    return record_planning(mux_queue, start)
+
+# Build a single mux queue from several batches of arguments, each one a list of files, the output directory of their
+# muxes and the `FontIndex` of the fonts to attach or None, stored in the `output_dir` and the `fonts` of their jobs.
+# Every file is identified once, even if it is in several batches.
+def make_batch_mux_queue(batches, probe_jobs=None, strict=False):
+    from concurrent.futures import ThreadPoolExecutor
+    start = perf_counter()
+    with planning_seconds.time():
+        files = {} # real path -> first argument naming it
+        for args, _, _ in batches:
+            for arg in args:
+                files.setdefault(realpath(arg), arg)
+        with ThreadPoolExecutor(max_workers=probe_jobs or PROBE_JOBS) as executor:
+            classified = dict(zip(files, executor.map(partial(classify_file, strict=strict), files.values())))
+
+        mux_queue = []
+        for args, output_dir, fonts in batches:
+            for tracks in match_files(args, [classified[realpath(arg)] for arg in args]):
+                mux_queue.append(tracks._replace(output_dir=output_dir, fonts=fonts))
+    return record_planning(mux_queue, start)
+
+# Return `mux_queue` with the time spent planning it since `start` stored in its jobs.
+def record_planning(mux_queue, start):
+    duration = perf_counter() - start
+    return [tracks._replace(planning_time=duration) for tracks in mux_queue]
+
+# A job of the mux queue: the video, its subtitles mapped to their `Properties`, the `FileInfo` of every file by path,
+# the seconds spent identifying its files and planning its batch, and the output directory and the `FontIndex` of its
+# batch, None for the defaults of the run. Jobs are records, built once, so that a queue of hundreds of thousands of
+# them stays compact.
+MuxJob = namedtuple('MuxJob', ['video', 'subtitles', 'infos', 'identify_time', 'planning_time', 'output_dir',
+                               'fonts'], defaults=(None, None, None))
+
+# Build the mux queue from the results of `classify_file` for each argument.
+def match_files(args, classified):
+    # Dictionaries instead of sets keep the queue in the order of the arguments.
+    subtitles = {}
+    videos = {}
+    infos = {}
+    identify_times = {}
+
+    for arg, (file_type, info, diagnostic, identify_time) in zip(args, classified):
+        if diagnostic is not None:
+            print(diagnostic, file=stderr)
             continue
-        file_type = container['type']
-        if file_type == 'SSA/ASS subtitles':
-            subtitles.add(Path(arg))
-        elif file_type in {'Matroska', 'QuickTime/MP4'}:
-            videos.add(Path(arg))
+        if file_type == 'subtitles':
+            subtitles[Path(arg)] = None
         else:
-            print(f"Unsupported container of '{arg}' by `subbot`, skipping...", file=stderr)
+            videos[Path(arg)] = None
+        infos[Path(arg)] = info
+        identify_times[Path(arg)] = identify_time
+
+    # Index the subtitles by stem, parsing their properties once, so that matching a video is a lookup.
+    subtitles_by_stem = {}
+    for subtitle in subtitles:
+        properties = parse_filename(subtitle.stem)
+        stem = subtitle.stem if properties is None else properties.stem
+        subtitles_by_stem.setdefault(stem, []).append((subtitle, properties))
 
     mux_queue = []
 
     for video in videos:
-        match_file_stem = lambda sub: strip_properties(sub.stem) == video.stem
-        tracks = {
-            'video': video,
-            'subtitles': {},
-        }
+        video_subtitles = {}
+        video_infos = {video: infos[video]}
+        identify_time = identify_times[video]
 
-        matched_subs = set(filter(match_file_stem, subtitles))
-        subtitles -= matched_subs # matched subs won't be consumed by other videos
-        for subtitle in matched_subs:
-            properties = get_properties(subtitle.stem)
-            if not properties:
+        # matched subs won't be consumed by other videos
+        for subtitle, properties in subtitles_by_stem.pop(video.stem, ()):
+            if properties is None:
                 print(f"No properties found in '{subtitle}', skipping...", file=stderr)
                 continue
-            tracks['subtitles'][subtitle] = properties
-        if not tracks['subtitles']:
+            video_subtitles[subtitle] = properties
+            video_infos[subtitle] = infos[subtitle]
+            identify_time += identify_times[subtitle]
+        if not video_subtitles:
             print(f"No subtitles associated to '{video}', skipping...", file=stderr)
             continue
-        mux_queue.append(tracks)
+        mux_queue.append(MuxJob(video, video_subtitles, video_infos, identify_time))
 
     return mux_queue
 
-def get_properties(filename):
-    properties = {
-        'track_name': None,
-        '_track_id': 0,
-        'language': 'und',
-        'default_track': False,
-        'forced_track': False,
-    }
-    # There could be more than one ' [' in the name, we need the last one, that's where the
-    # properties are. The last character must be one of the special characters supported.
-    splitted_filename = filename.split(sep=' [')
-    properties_string = splitted_filename[-1]
-    if not properties_string[-1] == ']':
-        return {}
+# The properties parsed from the name of a subtitle, see `parse_filename`.
+Properties = namedtuple('Properties', ['stem', 'track_id', 'track_name', 'language', 'default_track', 'forced_track'])
+
+# A property between square brackets, e.g. `2`, `'Test'`, `default` or `eng`.
+BRACKETED_PROPERTY = re.compile(r"(?P<track_id>\d+)|'(?P<track_name>.*)'|(?P<flag>default|forced)"
+                                r"|(?P<language>[a-z]{3})")
+# A property at the end of the stem preceded by a dot, e.g. `.eng` or `.forced`. Underscores and hyphens are not
+# separators: they are common in the stems themselves, and many words are language codes, e.g. `Show-fin`.
+SEPARATED_PROPERTY = re.compile(r'\.(default|forced|[a-z]{3})$')
+
+# Parse the properties of a subtitle from its stem in a single pass, either written between square brackets
+# (`example [2]['Test'][default][eng]`) or each one after a dot (`example.eng.forced`).
+# Returns None if the stem does not end with any property. The cache is bounded, since a watching `subbotf` parses new
+# names for as long as it runs.
+@lru_cache(maxsize=4096)
+def parse_filename(filename):
+    if filename.endswith(']'):
+        # There could be more than one ' [' in the name, we need the last one, that's where the properties are.
+        stem, separator, properties_string = filename.rpartition(' [')
+        if separator:
+            return parse_bracketed_properties(filename, stem, properties_string[:-1])
+    return parse_separated_properties(filename)
 
-    properties_string = properties_string[:-1] # remove last ']'
-    properties_list = properties_string.split(sep='][')
-    for prop in properties_list:
-        if prop.isdecimal():
-            properties['_track_id'] = int(prop)
-        elif prop[0] == prop[-1] == "'":
-            properties['track_name'] = prop[1:-1]
-        elif prop in ISO639_2_languages:
-            properties['language'] = prop
-        elif prop == 'default':
-            properties['default_track'] = True
+def parse_bracketed_properties(filename, stem, properties_string):
+    track_id = 0
+    track_name = None
+    language = 'und'
+    default_track = forced_track = False
+    for prop in properties_string.split(']['):
+        match = BRACKETED_PROPERTY.fullmatch(prop)
+        kind = match and match.lastgroup
+        if kind == 'track_id':
+            track_id = int(prop)
+        elif kind == 'track_name':
+            track_name = prop[1:-1]
+        elif kind == 'flag' and prop == 'default':
+            default_track = True
+        elif kind == 'flag':
+            forced_track = True
+        elif kind == 'language' and prop in ISO639_2_languages:
+            language = prop
+        else:
+            print(f"'{prop}' not recognised in '{filename}', skipping...", file=stderr)
+    return Properties(stem, track_id, track_name, language, default_track, forced_track)
+
+def parse_separated_properties(filename):
+    # The properties are read backwards from the end of the stem, up to the first token that is not a property.
+    stem = filename
+    language = None
+    default_track = forced_track = False
+    while True:
+        match = SEPARATED_PROPERTY.search(stem)
+        if match is None:
+            break
+        prop = match[1]
+        if prop == 'default':
+            default_track = True
         elif prop == 'forced':
-            properties['forced_track'] = True
+            forced_track = True
+        elif prop in ISO639_2_languages and language is None:
+            language = prop
         else:
-            print(f"'{prop}' not recognised in '{filename}', skipping...")
-    return properties
+            break
+        stem = stem[:match.start()]
+    if stem == filename or not stem:
+        return None
+    return Properties(stem, 0, None, language or 'und', default_track, forced_track)
+
+def get_properties(filename):
+    properties = parse_filename(filename)
+    if properties is None:
+        return {}
+    return {
+        'track_name': properties.track_name,
+        '_track_id': properties.track_id,
+        'language': properties.language,
+        'default_track': properties.default_track,
+        'forced_track': properties.forced_track,
+    }
+
+# Return `properties` as `Properties`, converting the dictionaries returned by `get_properties`, which the callers of
+# `make_mkvmerge_cmd` may still pass.
+def to_properties(properties):
+    if isinstance(properties, Properties):
+        return properties
+    return Properties(None, properties.get('_track_id', 0), properties.get('track_name'),
+                      properties.get('language', 'und'), properties.get('default_track', False),
+                      properties.get('forced_track', False))
 
 def strip_properties(filename):
-    # There could be other ' [' before the properties, we shall consider them
-    # part of the file name, thus `splitted` is a list of strings, not just a string.
-    splitted = filename.split(sep=' [')
-    if len(splitted) == 1: # `filename` does not contain properties.
-        return filename
-    # The properties are in the last string, so we don't consider them here.
-    return ' ['.join(splitted[:-1])
+    properties = parse_filename(filename)
+    return filename if properties is None else properties.stem
+
+# A copy counter N of type ' (N)' at the end of a stem.
+COPY_COUNTER = re.compile(r' \((\d+)\)$')
+
+# Split `stem` in the stem without its copy counter and the counter, 0 if there is none.
+def split_copy_counter(stem):
+    match = COPY_COUNTER.search(stem)
+    if match is None:
+        return stem, 0
+    return stem[:match.start()], int(match[1])
+
+# Reserve the output paths of a batch of muxes. The listing of every output directory is read once per batch, the
+# copy counters in use are indexed by stem and suffix, and every path is claimed by creating an empty placeholder with
+# `O_CREAT|O_EXCL`, so that concurrent muxes, even from other processes, never get the same path.
+class OutputReservations:
+    def __init__(self):
+        self.lock = Lock()
+        self.used_counters = {} # directory -> {(stem, suffix): set of copy counters}
+
+    def directory_counters(self, directory):
+        if directory not in self.used_counters:
+            counters = {}
+            try:
+                names = listdir(directory)
+            except OSError:
+                names = []
+            for name in names:
+                path = PurePath(name)
+                stem, copy_counter = split_copy_counter(path.stem)
+                counters.setdefault((stem, path.suffix), set()).add(copy_counter)
+            self.used_counters[directory] = counters
+        return self.used_counters[directory]
+
+    # Return the first path available among `path` and its copies with a higher counter, already created empty.
+    def reserve(self, path):
+        stem, copy_counter = split_copy_counter(path.stem)
+        with self.lock:
+            used = self.directory_counters(path.parent).setdefault((stem, path.suffix), set())
+            while True:
+                while copy_counter in used:
+                    copy_counter += 1
+                used.add(copy_counter)
+                candidate = path.parent / (stem + (f' ({copy_counter})' if copy_counter else '') + path.suffix)
+                try:
+                    close(osopen(candidate, O_WRONLY | O_CREAT | O_EXCL, 0o666))
+                    return candidate
+                except FileExistsError: # taken by someone else since the listing
+                    continue
+
+    # Remove the placeholder of `path` if it was not written.
+    @staticmethod
+    def release(path):
+        try:
+            if stat(path).st_size == 0:
+                unlink(path)
+        except OSError:
+            pass
 
 def first_available_path(path):
-    copy_counter = 0
-    stem = path.stem
-    # Check if the path already contains a copy counter N of type ' (N)' at the end.
-    counter_candidates = re.findall(r' \((\d+)\)$', stem)
-    if counter_candidates:
-        copy_counter += int(*counter_candidates)
-        stem = ''.join(stem.rsplit(f' ({copy_counter})', 1)) # remove the counter
-    while path.exists():
+    stem, copy_counter = split_copy_counter(path.stem)
+    used = OutputReservations().directory_counters(path.parent).get((stem, path.suffix), set())
+    while copy_counter in used:
         copy_counter += 1
-        path = path.parent / (stem + f' ({copy_counter})' + path.suffix)
-    return path
+    return path.parent / (stem + (f' ({copy_counter})' if copy_counter else '') + path.suffix)
 
-def make_mkvmerge_cmd(video_path, subtitles_properties, output_path):
-    mkv = MKVFile(video_path, mkvmerge_path=MKVMERGE_PATH)
+def make_mkvmerge_cmd(video_path, subtitles_properties, output_path, infos=None):
+    mkv, _ = make_mkv(video_path, subtitles_properties, infos)
+    return mkvmerge_command(mkv, output_path)
+
+# Return the `MKVFile` muxing the subtitles of `subtitles_properties` into `video_path`, and the track of every
+# subtitle in it. The fonts of `fonts`, a `FontIndex`, used by the subtitles are attached.
+def make_mkv(video_path, subtitles_properties, infos=None, fonts=None):
+    from pymkv import MKVFile, MKVTrack
+    # `infos` maps the paths already identified to their `mkvmerge -J` output or its `FileInfo`, so that they are not
+    # identified again.
+    infos = infos or {}
+    mkv = MKVFile(video_path, mkvmerge_path=MKVMERGE_PATH, info=infos.get(video_path))
     current_tracks = mkv.get_track()
+    subtitle_tracks = {}
 
-    for subtitle_path in subtitles_properties:
-        track_id = subtitles_properties[subtitle_path].pop('_track_id', 0)
+    for subtitle_path, properties in subtitles_properties.items():
+        properties = to_properties(properties)
+        track_id = properties.track_id
         subtitle_track = MKVTrack(
             file_path=subtitle_path,
             mkvmerge_path=MKVMERGE_PATH,
-            **subtitles_properties[subtitle_path]
+            info=infos.get(subtitle_path),
+            track_name=properties.track_name,
+            language=properties.language,
+            default_track=properties.default_track,
+            forced_track=properties.forced_track,
         )
+        subtitle_tracks[subtitle_path] = subtitle_track
 
         if 0 <= track_id < len(current_tracks) \
         and current_tracks[track_id].track_type == 'subtitles':
@@ -142,6 +388,35 @@ def make_mkvmerge_cmd(video_path, subtitles_properties, output_path):
         else:
             mkv.add_track(subtitle_track)
 
+    if fonts is not None:
+        attach_fonts(mkv, subtitles_properties, fonts, infos.get(video_path))
+    return mkv, subtitle_tracks
+
+# Attach to `mkv` the fonts of `fonts` used by `subtitles`, once each, except the ones whose file name is already the
+# name of an attachment of the video, according to `video_info`, its `mkvmerge -J` output or its `FileInfo`.
+def attach_fonts(mkv, subtitles, fonts, video_info=None):
+    from pymkv import MKVAttachment
+    from pymkv.ASS import used_fonts
+    attached = set()
+    if video_info is not None:
+        attached = {file_name.casefold() for file_name in FileInfo.from_info(video_info).attachments}
+    font_paths = {}
+    for subtitle_path in subtitles:
+        try:
+            used = used_fonts(subtitle_path)
+        except OSError:
+            continue
+        for name, bold, italic in sorted(used):
+            font_path = fonts.find(name, bold, italic)
+            if font_path is None:
+                print(f"Font '{name}' of '{subtitle_path}' not found in the fonts directories, skipping...",
+                      file=stderr)
+            elif PurePath(font_path).name.casefold() not in attached:
+                font_paths[font_path] = None
+    for font_path in font_paths:
+        mkv.add_attachment(MKVAttachment(font_path))
+
+def mkvmerge_command(mkv, output_path):
     command = mkv.command(output_path, subprocess=True)
     # Add option to parse non-translated, `\n`-terminated (instead of `\r`) lines.
     command.insert(1, '--gui-mode')
@@ -149,49 +424,818 @@ def make_mkvmerge_cmd(video_path, subtitles_properties, output_path):
 
 # To be set by other users of `main`.
 def show_progress(process, output_path):
-    for line in process.stdout:
-        if line.startswith(('#GUI#warning', '#GUI#error')):
-            print(line[5:].title().strip(), file=stderr)
+    for event in iter_events(process.stdout):
+        if not isinstance(event, ProgressEvent):
+            print(event, file=stderr)
+
+# Name of the manifest of the muxes done in an output directory, used by the incremental mode.
+MANIFEST_NAME = '.subbot-manifest.json'
+# Stands for the output path in the commands fingerprinted, since it depends on the files already in the output
+# directory.
+OUTPUT_PLACEHOLDER = '<output>'
+
+# Return a fingerprint of the mux of `tracks` by `command`: the paths, sizes and modification times of its inputs and
+# of its `attachments`, the properties parsed from the names of the subtitles and the command itself.
+def mux_fingerprint(tracks, command, attachments=()):
+    from hashlib import sha256
+    files = []
+    for path in (tracks.video, *tracks.subtitles, *attachments):
+        stat_result = stat(path)
+        files.append([realpath(path), stat_result.st_size, stat_result.st_mtime_ns])
+    properties = [list(properties) for properties in tracks.subtitles.values()]
+    return sha256(json.dumps([files, properties, command]).encode()).hexdigest()
+
+# Return a fingerprint of everything the output of `mkv` depends on but the properties of the subtitles, and these
+# properties by index of their track in the output, as set by `pymkv.EBML.edit_track_entries`. The inputs are
+# identified by inode, size and modification time, so that renaming a subtitle to change its properties keeps the
+# fingerprint.
+def mux_layout(mkv, subtitle_tracks):
+    from hashlib import sha256
+    files = {} # path -> index in `stats`
+    stats = []
+    sources = []
+    for track in mkv.tracks:
+        if track.file_path not in files:
+            stat_result = stat(track.file_path)
+            files[track.file_path] = len(stats)
+            stats.append([stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns])
+        sources.append([files[track.file_path], track.track_id])
+    for attachment in mkv.attachments:
+        stat_result = stat(attachment.file_path)
+        stats.append([stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns])
+    layout = sha256(json.dumps([stats, sources, mkv.title]).encode()).hexdigest()
+
+    # `--track-order` keeps the tracks of the output in the order of `mkv.tracks`.
+    indexes = {id(track): index for index, track in enumerate(mkv.tracks)}
+    subtitles = [[indexes[id(track)], {
+        'track_name': track.track_name,
+        'language': track.language,
+        'default_track': track.default_track,
+        'forced_track': track.forced_track,
+    }] for track in subtitle_tracks.values() if id(track) in indexes] # unless replaced by another subtitle
+    return layout, subtitles
+
+# Edit in place the properties of the subtitles of `output_path` from `previous` to `subtitles`, both as returned by
+# `mux_layout`. Return whether it was done.
+def edit_output(output_path, previous, subtitles):
+    from pymkv.EBML import edit_track_entries
+    previous = {index: properties for index, properties in previous}
+    edits = {index: properties for index, properties in subtitles if previous.get(index) != properties}
+    if not edits:
+        return True
+    try:
+        return edit_track_entries(output_path, edits)
+    except (OSError, ValueError, IndexError):
+        return False
+
+# The muxes done in an output directory, by video: the fingerprints of each mux, the properties of its subtitles and
+# the output it produced. An output is considered up to date, or can be edited, only if it still has the size and the
+# modification time it had after the mux.
+class Manifest:
+    def __init__(self, output_dir):
+        self.path = Path(output_dir) / MANIFEST_NAME
+        self.lock = Lock()
+        self.entries = self.load()
+        self.updated = {}
+
+    def load(self):
+        try:
+            with open(self.path) as manifest:
+                entries = json.load(manifest).get('outputs', {})
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
 
-def merge(tracks, output_dir):
-    video_path = tracks['video']
-    subtitles_properties = tracks['subtitles']
-    output_path = first_available_path(output_dir / (video_path.stem + '.mkv'))
+    # Return the entry of the last mux of `video_path` and its output, if the output is still there.
+    def lookup(self, video_path):
+        with self.lock:
+            entry = self.entries.get(realpath(video_path))
+        if not isinstance(entry, dict):
+            return None, None
+        output_path = self.path.parent / entry.get('output', '')
+        try:
+            stat_result = stat(output_path)
+        except OSError:
+            return None, None
+        if [stat_result.st_size, stat_result.st_mtime_ns] != entry.get('stat'):
+            return None, None
+        return entry, output_path
+
+    # Record the mux of `video_path` into `output_path`, `entry` holding its fingerprints and the properties of its
+    # subtitles.
+    def record(self, video_path, entry, output_path):
+        stat_result = stat(output_path)
+        entry = {
+            **entry,
+            'output': output_path.name,
+            'stat': [stat_result.st_size, stat_result.st_mtime_ns],
+        }
+        with self.lock:
+            self.entries[realpath(video_path)] = entry
+            self.updated[realpath(video_path)] = entry
 
+    # Write the entries recorded, on top of the ones written in the meantime by other processes. The manifest is
+    # replaced atomically, so that it is never left half written.
+    def save(self):
+        with self.lock:
+            if not self.updated:
+                return
+            entries = {**self.load(), **self.updated}
+            temporary_path = self.path.with_name(f'{self.path.name}.{getpid()}.tmp')
+            try:
+                with open(temporary_path, 'w') as manifest:
+                    json.dump({'version': 1, 'outputs': entries}, manifest)
+                replace(temporary_path, self.path)
+            except OSError:
+                print(f"Could not write the manifest '{self.path}'.", file=stderr)
+                try:
+                    unlink(temporary_path)
+                except OSError:
+                    pass
+                return
+            self.entries = entries
+            self.updated = {}
+
+# Build the command muxing `tracks` in `output_dir`, check it against `manifest`, if any, and reserve its output path.
+# Return the command, its output path, the entry to record in `manifest` after the mux, the status of the job and the
+# estimated size of the output, or None if the command could not be built. If the previous output in `manifest` is up
+# to date, or differs only by the properties of its subtitles and could be edited in place, the command is None and
+# the status 'up_to_date' or 'edited'.
+def prepare_merge(tracks, output_dir, reservations, manifest=None):
+    video_path = tracks.video
     try:
-        command = make_mkvmerge_cmd(video_path, subtitles_properties, output_path)
+        mkv, subtitle_tracks = make_mkv(video_path, tracks.subtitles, tracks.infos, tracks.fonts)
+        command = mkvmerge_command(mkv, OUTPUT_PLACEHOLDER)
     except Exception:
-        print(f"While muxing '{video_path}' in '{output_path}' an exception occurred, skipping...",
-              file=stderr)
+        print(f"While muxing '{video_path}' in '{output_dir}' an exception occurred, skipping...", file=stderr)
         print_exc(file=stderr)
+        return None
+
+    entry = None
+    if manifest is not None:
+        try:
+            layout, subtitles = mux_layout(mkv, subtitle_tracks)
+            fingerprint = mux_fingerprint(tracks, command, [attachment.file_path for attachment in mkv.attachments])
+            entry = {'fingerprint': fingerprint, 'layout': layout, 'subtitles': subtitles}
+        except OSError:
+            pass
+        previous, output_path = manifest.lookup(video_path) if entry else (None, None)
+        if previous is not None and previous.get('fingerprint') == entry['fingerprint']:
+            return None, output_path, entry, 'up_to_date', None
+        if previous is not None and previous.get('layout') == entry['layout'] \
+        and edit_output(output_path, previous.get('subtitles', []), entry['subtitles']):
+            manifest.record(video_path, entry, output_path)
+            return None, output_path, entry, 'edited', None
+
+    output_path = reservations.reserve(output_dir / (video_path.stem + '.mkv'))
+    command[command.index('-o') + 1] = str(output_path)
+    size = estimate_output_size(tracks, [attachment.file_path for attachment in mkv.attachments])
+    return command, output_path, entry, 'muxed', size
+
+# Stands for `pipe`, the stdout of a `mkvmerge` process opened in text mode, keeping the warnings and errors of
+# `mkvmerge` read from it in `messages`, however `show_progress` reads it. The rest of the file interface is `pipe`'s.
+class MessagePipe:
+    def __init__(self, pipe, messages):
+        self.pipe = pipe
+        self.messages = messages
+        self.partial = '' # the end of the last line read, until the rest of it is
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def readline(self, size=-1):
+        return self.collect(self.pipe.readline(size))
+
+    def readlines(self, hint=-1):
+        lines = self.pipe.readlines(hint)
+        self.collect(''.join(lines))
+        return lines
+
+    def read(self, size=-1):
+        return self.collect(self.pipe.read(size))
+
+    # Keep the messages of the complete lines of `data`, read from `pipe`, and return it.
+    def collect(self, data):
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            if line.startswith(('#GUI#warning', '#GUI#error')):
+                self.messages.append(parse_line(line))
+        return data
+
+# Same as `MessagePipe`, for the `asyncio.StreamReader` read by `show_progress_async`.
+class MessageStream(MessagePipe):
+    def __init__(self, stream, messages):
+        super().__init__(stream, messages)
+        self.decoder = getincrementaldecoder('utf-8')(errors='replace')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
+
+    async def readline(self):
+        return self.collect(await self.pipe.readline())
+
+    async def readuntil(self, separator=b'\n'):
+        return self.collect(await self.pipe.readuntil(separator))
+
+    async def readexactly(self, n):
+        return self.collect(await self.pipe.readexactly(n))
+
+    async def read(self, n=-1):
+        return self.collect(await self.pipe.read(n))
+
+    def collect(self, data):
+        super().collect(self.decoder.decode(data))
+        return data
+
+# Print the outcome of the job `tracks`, 'muxed', 'failed', 'up_to_date', 'edited', 'no_space' or 'error': its
+# output path if it is there, or with `JSON_OUTPUT` a JSON line recording its inputs, its output, the return code,
+# warnings and errors of `mkvmerge` in `messages`, the time spent on each step and the bytes written.
+def report(tracks, status, output_path=None, returncode=None, messages=(), mux_time=None):
+    if not JSON_OUTPUT:
+        if status in {'muxed', 'up_to_date', 'edited'}:
+            with stdout_lock:
+                print(output_path, flush=True)
         return
 
-    process = Popen(command, stdout=PIPE, text=True, bufsize=1)
-    show_progress(process, str(output_path))
-    returncode = process.wait()
+    bytes_written = 0
+    if returncode is not None:
+        try:
+            bytes_written = stat(output_path).st_size
+        except OSError: # removed after failing
+            pass
+    record = json.dumps({
+        'video': str(tracks.video),
+        'subtitles': [str(subtitle) for subtitle in tracks.subtitles],
+        'output': None if output_path is None else str(output_path),
+        'status': status,
+        'returncode': returncode,
+        'warnings': [message.message for message in messages if isinstance(message, WarningEvent)],
+        'errors': [message.message for message in messages if isinstance(message, ErrorEvent)],
+        'timings': {'identify': tracks.identify_time, 'planning': tracks.planning_time, 'mux': mux_time},
+        'bytes_written': bytes_written,
+    })
+    with stdout_lock:
+        print(record, flush=True)
+
+# Record the metrics of a mux of `output_path` which lasted `duration` seconds.
+def record_mux(output_path, returncode, duration):
+    mux_seconds.observe(duration, returncode=returncode)
+    if returncode != 0:
+        jobs_total.inc(outcome='failed')
+        return
+    jobs_total.inc(outcome='muxed')
+    try:
+        output_bytes.observe(stat(output_path).st_size)
+    except OSError:
+        pass
+
+# Return an estimate of the size of the output of `tracks`: the size of all its inputs and of its `attachments`, e.g.
+# the fonts attached, since `mkvmerge` copies them.
+def estimate_output_size(tracks, attachments=()):
+    size = 0
+    for path in (tracks.video, *tracks.subtitles, *attachments):
+        try:
+            size += stat(path).st_size
+        except OSError:
+            pass
+    return size
+
+# The space reserved on every filesystem by the muxes running on it, so that a mux is only started if the filesystem
+# of its output can hold it along with the ones running, and `headroom` bytes more.
+class DiskSpace:
+    def __init__(self, headroom=None):
+        self.headroom = HEADROOM if headroom is None else headroom
+        self.condition = Condition()
+        self.running = {} # device -> {output path: estimated size}
+
+    # Reserve `size` bytes for `output_path`, waiting for the muxes running on its filesystem if needed. Return False
+    # if the filesystem cannot hold it even once they are done.
+    def reserve(self, output_path, size):
+        with self.condition:
+            while True:
+                admitted = self.admit(output_path, size)
+                if admitted is not None:
+                    return admitted
+                # The free space is also checked again from time to time, in case other processes free some.
+                self.condition.wait(SPACE_POLL)
+
+    # Same as `reserve`, without blocking the event loop: the free space is read in a thread.
+    async def reserve_async(self, output_path, size):
+        import asyncio
+        while True:
+            admitting = asyncio.ensure_future(asyncio.to_thread(self.try_reserve, output_path, size))
+            try:
+                admitted = await asyncio.shield(admitting)
+            except asyncio.CancelledError:
+                # The thread cannot be interrupted, the space it reserved meanwhile is released.
+                if await wait_uninterrupted(admitting):
+                    self.release(output_path)
+                raise
+            if admitted is not None:
+                return admitted
+            await asyncio.sleep(SPACE_POLL)
+
+    # Same as `admit`, holding the lock of the running muxes.
+    def try_reserve(self, output_path, size):
+        with self.condition:
+            return self.admit(output_path, size)
+
+    # Return True and reserve the space if `output_path` fits now, None if it has to wait for the muxes running on
+    # its filesystem, and False if it does not fit at all.
+    def admit(self, output_path, size):
+        try:
+            device = stat(output_path.parent).st_dev
+            vfs = statvfs(output_path.parent)
+        except OSError: # the space cannot be known, let `mkvmerge` try
+            return True
+        running = self.running.setdefault(device, {})
+        # The outputs of the running muxes are partly written already, which the free space accounts for.
+        reserved = 0
+        for path, estimate in running.items():
+            try:
+                reserved += max(0, estimate - stat(path).st_size)
+            except OSError:
+                reserved += estimate
+        if reserved + size + self.headroom <= vfs.f_bavail * vfs.f_frsize:
+            running[output_path] = size
+            return True
+        return None if running else False
+
+    def release(self, output_path):
+        with self.condition:
+            for running in self.running.values():
+                running.pop(output_path, None)
+            self.condition.notify_all()
+
+# Print that `tracks` cannot be muxed into `output_path` for lack of space, and release the output path.
+def refuse_merge(tracks, output_path, size, headroom):
+    OutputReservations.release(output_path)
+    print(f"Not enough space in '{output_path.parent}' to mux '{tracks.video}' ({size} bytes and a headroom of "
+          f"{headroom} bytes), skipping...", file=stderr)
+    jobs_total.inc(outcome='no_space')
+    report(tracks, 'no_space')
+
+def merge(tracks, output_dir, reservations=None, manifest=None, disk_space=None):
+    prepared = prepare_merge(tracks, output_dir, reservations or OutputReservations(), manifest)
+    if prepared is None:
+        jobs_total.inc(outcome='error')
+        report(tracks, 'error')
+        return
+    command, output_path, entry, status, size = prepared
+    if command is None: # up to date or edited
+        jobs_total.inc(outcome=status)
+        report(tracks, status, output_path)
+        return
+
+    disk_space = disk_space or DiskSpace()
+    if not disk_space.reserve(output_path, size):
+        refuse_merge(tracks, output_path, size, disk_space.headroom)
+        return
+    try:
+        start = perf_counter()
+        mkvmerge_invocations.inc(site='mux')
+        process = Popen(command, stdout=PIPE, text=True, bufsize=1)
+        messages = []
+        pipe = process.stdout
+        try:
+            process.stdout = MessagePipe(pipe, messages)
+            show_progress(process, str(output_path))
+            # The output left unread by `show_progress` may hold messages, and would fill the pipe.
+            if not pipe.closed:
+                process.stdout.read()
+        finally:
+            process.stdout = pipe
+            pipe.close()
+            returncode = process.wait()
+    finally:
+        disk_space.release(output_path)
+    finish_merge(tracks, output_path, entry, manifest, returncode, messages, perf_counter() - start)
+
+# Record the outcome of the mux of `tracks` into `output_path` by `mkvmerge`, which returned `returncode` after
+# `mux_time` seconds: its metrics, its manifest `entry` if it succeeded, and its report.
+def finish_merge(tracks, output_path, entry, manifest, returncode, messages, mux_time):
+    record_mux(output_path, returncode, mux_time)
     if returncode == 0:
-        print(output_path)
-    elif returncode == 2:
-        print(f"Could not mux '{video_path}' in '{output_path}', skipping...", file=stderr)
+        if entry is not None:
+            manifest.record(tracks.video, entry, output_path)
+    else:
+        OutputReservations.release(output_path)
+        if returncode == 2:
+            print(f"Could not mux '{tracks.video}' in '{output_path}', skipping...", file=stderr)
+    report(tracks, 'muxed' if returncode == 0 else 'failed', output_path, returncode, messages, mux_time)
 
-def main(args):
-    if len(args) < 2:
-        print('Usage: subbot file1.vid file1.sub ... [output_dir]')
+# To be set by other users of `main_async`, like `show_progress` but reading a `asyncio.subprocess.Process`.
+async def show_progress_async(process, output_path):
+    async for line in process.stdout:
+        event = parse_line(line.decode())
+        if event is not None and not isinstance(event, ProgressEvent):
+            print(event, file=stderr)
+
+# Same as `merge`, but without blocking the event loop. Return the output path if the mux succeeded. If the task is
+# cancelled, `mkvmerge` is terminated and the partial output removed.
+async def merge_async(tracks, output_dir, reservations=None, manifest=None, disk_space=None):
+    import asyncio
+    # Building the command reads the files, the fonts and the manifest, so it runs in a thread.
+    preparing = asyncio.ensure_future(asyncio.to_thread(prepare_merge, tracks, output_dir,
+                                                        reservations or OutputReservations(), manifest))
+    try:
+        prepared = await asyncio.shield(preparing)
+    except asyncio.CancelledError:
+        await wait_uninterrupted(release_prepared(preparing))
+        raise
+    if prepared is None:
+        jobs_total.inc(outcome='error')
+        report(tracks, 'error')
+        return None
+    command, output_path, entry, status, size = prepared
+    if command is None: # up to date or edited
+        jobs_total.inc(outcome=status)
+        report(tracks, status, output_path)
+        return output_path
+
+    disk_space = disk_space or DiskSpace()
+    try:
+        admitted = await disk_space.reserve_async(output_path, size)
+    except asyncio.CancelledError:
+        await wait_uninterrupted(asyncio.to_thread(OutputReservations.release, output_path))
+        raise
+    if not admitted:
+        await asyncio.to_thread(refuse_merge, tracks, output_path, size, disk_space.headroom)
+        return None
+    try:
+        start = perf_counter()
+        process = None
+        try:
+            mkvmerge_invocations.inc(site='mux')
+            process = await asyncio.create_subprocess_exec(*command, stdout=PIPE)
+            messages = []
+            pipe = process.stdout
+            try:
+                process.stdout = MessageStream(pipe, messages)
+                await show_progress_async(process, str(output_path))
+                # The output left unread by `show_progress_async` may hold messages, and would fill the pipe.
+                await process.stdout.read()
+            finally:
+                process.stdout = pipe
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            await wait_uninterrupted(abort_merge(process, output_path))
+            raise
+    finally:
+        disk_space.release(output_path)
+    # Recording the outcome stats the output, so it runs in a thread, and to its end even if the task is cancelled
+    # meanwhile, since the mux is done.
+    await wait_uninterrupted(asyncio.to_thread(finish_merge, tracks, output_path, entry, manifest, returncode, messages,
+                                               perf_counter() - start))
+    return output_path if returncode == 0 else None
+
+# Release the output path reserved by `preparing`, the future of a `prepare_merge` whose merge was cancelled, once the
+# thread running it is done, since it cannot be interrupted.
+async def release_prepared(preparing):
+    import asyncio
+    try:
+        prepared = await preparing
+    except Exception: # nothing was reserved
+        return
+    if prepared is not None and prepared[0] is not None:
+        await asyncio.to_thread(OutputReservations.release, prepared[1])
+
+# Clean up after a cancelled mux into `output_path`: terminate its `mkvmerge` process, if it was started, and remove
+# its partial output, or release the output path if nothing was written.
+async def abort_merge(process, output_path):
+    import asyncio
+    if process is None:
+        await asyncio.to_thread(OutputReservations.release, output_path)
+        return
+    if process.returncode is None:
+        process.terminate()
+        await process.wait()
+    await asyncio.to_thread(remove_output, output_path)
+
+def remove_output(output_path):
+    try:
+        unlink(output_path)
+    except FileNotFoundError:
+        pass
+
+# Wait for `awaitable` to finish and return its result, even if the current task is cancelled again meanwhile, for the
+# cleanups that must not be interrupted halfway.
+async def wait_uninterrupted(awaitable):
+    import asyncio
+    future = asyncio.ensure_future(awaitable)
+    while True:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled():
+                raise
+
+# Return whether the block device `device` is a rotational disk, according to sysfs.
+def is_rotational(device):
+    sysfs_device = f'/sys/dev/block/{major(device)}:{minor(device)}'
+    if isfile(f'{sysfs_device}/partition'): # partitions share the queue of their disk
+        sysfs_device = realpath(f'{sysfs_device}/..')
+    try:
+        with open(f'{sysfs_device}/queue/rotational') as rotational:
+            return rotational.read().strip() == '1'
+    except OSError: # not a block device, e.g. tmpfs or NFS
+        return False
+
+# Return the devices read or written by the mux of `tracks` into `output_dir`.
+def mux_devices(tracks, output_dir):
+    devices = set()
+    for path in (tracks.video, *tracks.subtitles, output_dir):
+        try:
+            devices.add(stat(path).st_dev)
+        except OSError:
+            pass
+    return devices
+
+# Run the muxes of `mux_queue`, `jobs` at a time and at most `device_jobs` on the same device. By default, a
+# rotational disk gets one mux at a time, while other devices get as many as `jobs`. If `incremental`, the muxes whose
+# fingerprint matches the one in the manifest of their output directory are skipped, and the muxes done are recorded
+# there. The jobs with an `output_dir` are muxed there instead of `output_dir`. A mux only starts once the filesystem
+# of its output has room for it, the muxes running there and `headroom` bytes, and is skipped if it never will.
+def run_mux_queue(mux_queue, output_dir, jobs=None, device_jobs=None, incremental=False, headroom=None):
+    manifests = make_manifests(mux_queue, output_dir) if incremental else {}
+    try:
+        _run_mux_queue(mux_queue, output_dir, jobs, device_jobs, manifests, DiskSpace(headroom))
+    finally:
+        save_manifests(manifests)
+
+# Return the output directory of the mux of `tracks`, `output_dir` unless the job has its own.
+def job_output_dir(tracks, output_dir):
+    return output_dir if tracks.output_dir is None else tracks.output_dir
+
+# Return the manifests of the output directories of `mux_queue`, by directory.
+def make_manifests(mux_queue, output_dir):
+    return {directory: Manifest(directory)
+            for directory in dict.fromkeys(job_output_dir(tracks, output_dir) for tracks in mux_queue)}
+
+# Write the entries recorded in `manifests` to their files.
+def save_manifests(manifests):
+    for manifest in manifests.values():
+        manifest.save()
+
+def _run_mux_queue(mux_queue, output_dir, jobs, device_jobs, manifests, disk_space):
+    from concurrent.futures import ThreadPoolExecutor
+    jobs = jobs or JOBS
+    reservations = OutputReservations()
+    def run_merge(tracks):
+        directory = job_output_dir(tracks, output_dir)
+        merge(tracks, directory, reservations, manifests.get(directory), disk_space)
+
+    if jobs == 1:
+        for tracks in mux_queue:
+            run_merge(tracks)
         return
 
+    # The jobs are grouped by the devices they use, in the order of the queue, and the limits of the devices are read
+    # upfront, so that starting a job only looks at the first job of every group.
+    limits = {}
+    pending = {} # devices -> deque of (index in the queue, job)
+    for index, tracks in enumerate(mux_queue):
+        devices = frozenset(mux_devices(tracks, job_output_dir(tracks, output_dir)))
+        for device in devices:
+            if device not in limits:
+                limits[device] = device_jobs or (1 if is_rotational(device) else jobs)
+        pending.setdefault(devices, deque()).append((index, tracks))
+    active = 0
+    running = {} # device -> number of muxes running on it
+    condition = Condition()
+
+    def run(tracks, devices):
+        nonlocal active
+        try:
+            run_merge(tracks)
+        finally:
+            with condition:
+                active -= 1
+                for device in devices:
+                    running[device] -= 1
+                condition.notify()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        with condition:
+            while pending:
+                # Start the first job in the queue whose devices have room, so that a busy disk does not hold back
+                # the jobs on the other ones.
+                devices = None
+                if active < jobs:
+                    devices = min((devices for devices in pending
+                                   if all(running.get(device, 0) < limits[device] for device in devices)),
+                                  key=lambda devices: pending[devices][0][0], default=None)
+                if devices is None:
+                    condition.wait()
+                    continue
+                _, tracks = pending[devices].popleft()
+                if not pending[devices]:
+                    del pending[devices]
+                active += 1
+                for device in devices:
+                    running[device] = running.get(device, 0) + 1
+                futures.append(executor.submit(run, tracks, devices))
+    for future in futures:
+        future.result()
+
+# Same as `run_mux_queue`, but running the muxes as tasks of the event loop. Return the output paths of the muxes
+# that succeeded, in the order of `mux_queue`.
+async def run_mux_queue_async(mux_queue, output_dir, jobs=None, device_jobs=None, incremental=False, headroom=None):
+    import asyncio
+    jobs = jobs or JOBS
+    manifests = await asyncio.to_thread(make_manifests, mux_queue, output_dir) if incremental else {}
+    reservations = OutputReservations()
+    disk_space = DiskSpace(headroom)
+    semaphore = asyncio.Semaphore(jobs)
+    device_semaphores = {}
+    async def device_semaphore(device):
+        if device not in device_semaphores:
+            # sysfs and the inputs may be slow to read, e.g. on NFS, so they are read in threads.
+            limit = device_jobs or (1 if await asyncio.to_thread(is_rotational, device) else jobs)
+            device_semaphores.setdefault(device, asyncio.Semaphore(limit))
+        return device_semaphores[device]
+
+    async def run(tracks):
+        # Every job takes its devices in the same order, then a global slot, so that they never wait for each other
+        # in a cycle and a job waiting for a busy disk does not hold a slot.
+        directory = job_output_dir(tracks, output_dir)
+        devices = sorted(await asyncio.to_thread(mux_devices, tracks, directory))
+        acquired = []
+        try:
+            for device in devices:
+                await (await device_semaphore(device)).acquire()
+                acquired.append(device)
+            async with semaphore:
+                return await merge_async(tracks, directory, reservations, manifests.get(directory), disk_space)
+        finally:
+            for device in acquired:
+                device_semaphores[device].release()
+
+    tasks = [asyncio.ensure_future(run(tracks)) for tracks in mux_queue]
+    try:
+        return [path for path in await asyncio.gather(*tasks) if path is not None]
+    except BaseException:
+        # A merge failed or the run was cancelled: every other merge is cancelled, and the manifests are only saved
+        # once all of them have terminated their `mkvmerge` and removed their partial output.
+        for task in tasks:
+            task.cancel()
+        await wait_uninterrupted(asyncio.gather(*tasks, return_exceptions=True))
+        raise
+    finally:
+        await wait_uninterrupted(asyncio.to_thread(save_manifests, manifests))
+
+def positive_int(string):
+    from argparse import ArgumentTypeError
+    try:
+        value = int(string)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid int value: '{string}'")
+    if value < 1:
+        raise ArgumentTypeError(f"'{string}' is not a positive integer")
+    return value
+
+# A number of bytes, optionally followed by a binary unit: K, M, G or T, e.g. `512M`.
+def byte_size(string):
+    from argparse import ArgumentTypeError
+    match = re.fullmatch(r'(\d+)\s*([KMGT]?)(?:i?B)?', string.strip(), re.IGNORECASE)
+    if match is None:
+        raise ArgumentTypeError(f"invalid size: '{string}'")
+    return int(match[1]) * 1024 ** ' KMGT'.index(match[2].upper() or ' ')
+
+# The options shared with other users of `main`, e.g. `subbotf`.
+def option_parser():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument('--probe-jobs', type=positive_int, default=PROBE_JOBS, metavar='N',
+                        help='number of files identified at the same time (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=positive_int, default=JOBS, metavar='N',
+                        help='number of muxes run at the same time (default: %(default)s)')
+    parser.add_argument('--device-jobs', type=positive_int, metavar='N',
+                        help='number of muxes run at the same time on the same device (default: 1 on '
+                             'rotational disks, as many as --jobs otherwise)')
+    parser.add_argument('--headroom', type=byte_size, default=HEADROOM, metavar='SIZE',
+                        help='space to leave free on the filesystem of the outputs, e.g. 10G: a mux waits for the '
+                             'ones running there if it does not fit, and is skipped if it never will (default: '
+                             '%(default)s)')
+    parser.add_argument('--fonts', action='append', metavar='DIR',
+                        help='attach the fonts of DIR used by the subtitles, once each, unless the video already has a '
+                             'font of the same file name (can be repeated)')
+    parser.add_argument('--strict', action='store_true',
+                        help='identify every file with `mkvmerge`, even the ones recognised by their first bytes')
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help='write the metrics of the run to PATH at its end, in the Prometheus text format')
+    parser.add_argument('--json', action='store_true',
+                        help='print a JSON line per job instead of the output paths, with its inputs, output, status, '
+                             'return code, warnings of `mkvmerge`, timings and bytes written')
+    parser.add_argument('--incremental', action='store_true',
+                        help=f'skip the muxes whose inputs, properties and command did not change since the last '
+                             f'run, according to the {MANIFEST_NAME} file in the output directory, and edit in '
+                             f'place the outputs whose subtitles only changed properties')
+    return parser
+
+# Return `mux_queue` with the fonts of `directories` attached to its muxes, if any.
+def set_fonts(mux_queue, directories):
+    if not directories:
+        return mux_queue
+    from pymkv import FontIndex
+    fonts = FontIndex(directories)
+    return [tracks._replace(fonts=fonts) for tracks in mux_queue]
+
+# Write the metrics of the run to `path`, if any.
+def write_metrics(path):
+    if not path:
+        return
+    try:
+        metrics.write_textfile(path)
+    except OSError as error:
+        print(f"Could not write the metrics in '{path}': {error}", file=stderr)
+
+def parse_args(args):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='subbot', usage='%(prog)s [options] [--] file1.vid file1.sub ... [output_dir]',
+                            parents=[option_parser()])
+    parser.add_argument('files', nargs='*', help='videos and subtitles to merge, optionally followed by the '
+                                                 'output directory')
+    return parser.parse_args(args)
+
+# Return the options of `main` parsed from `args`, the files to merge and the output directory, or None if there is
+# nothing to merge. Raise FileNotFoundError if `mkvmerge` cannot be found.
+def setup_main(args):
+    global JSON_OUTPUT
+    options = parse_args(args)
+    JSON_OUTPUT = options.json
+    files = options.files
+    if len(files) < 2:
+        print('Usage: subbot [options] [--] file1.vid file1.sub ... [output_dir]')
+        return None
+
     if which(MKVMERGE_PATH) is None:
-        print('Could not find `mkvmerge`, please add it to $PATH.')
-        sysexit(1)
+        raise FileNotFoundError('Could not find `mkvmerge`, please add it to $PATH.')
+    # The command-line tools cache the identifications across runs, pymkv alone does not.
+    enable_identify_cache()
 
     output_dir = Path.cwd()
-    if isdir(args[-1]):
-        output_dir = Path(args[-1])
-        args.pop(-1)
+    if isdir(files[-1]):
+        output_dir = Path(files[-1])
+        files = files[:-1]
+    return options, files, output_dir
 
-    mux_queue = make_mux_queue(args)
-    for tracks in mux_queue:
-        merge(tracks, output_dir)
+def main(args):
+    try:
+        setup = setup_main(args)
+    except FileNotFoundError as error:
+        print(error, file=stderr)
+        sysexit(1)
+    if setup is None:
+        return
+    options, files, output_dir = setup
+
+    try:
+        mux_queue = make_mux_queue(files, options.probe_jobs, options.strict)
+        mux_queue = set_fonts(mux_queue, options.fonts)
+        run_mux_queue(mux_queue, output_dir, options.jobs, options.device_jobs, options.incremental,
+                      options.headroom)
+    finally:
+        write_metrics(options.metrics_file)
+
+# Same as `main`, for the users running an event loop. Instead of exiting, it raises FileNotFoundError if `mkvmerge`
+# cannot be found, and ValueError if `args` are invalid, so that the process embedding it keeps running.
+async def main_async(args):
+    import asyncio
+    try:
+        # Looking for `mkvmerge` and the output directory may be slow too.
+        setup = await asyncio.to_thread(setup_main, args)
+    except SystemExit as error: # `argparse` exits after printing the error or the help
+        raise ValueError(f'Invalid arguments: {args}') from error
+    if setup is None:
+        return
+    options, files, output_dir = setup
+
+    try:
+        mux_queue = await make_mux_queue_async(files, options.probe_jobs, options.strict)
+        mux_queue = set_fonts(mux_queue, options.fonts)
+        await run_mux_queue_async(mux_queue, output_dir, options.jobs, options.device_jobs, options.incremental,
+                                  options.headroom)
+    finally:
+        write_metrics(options.metrics_file)
 
 if __name__ == '__main__':
-    sigint_handler()
+    handle_sigint()
     main(argv[1:]) # Remove first 
@@ -1,88 +1,357 @@
-from fnmatch import filter as fnfilter, fnmatch
-from glob    import glob
-from os      import environ, listdir
+from argparse import ArgumentParser
+from fnmatch import filter as fnfilter, fnmatch, translate
+from functools import lru_cache
+from glob    import glob, has_magic
+from os      import close, environ, fsdecode, fsencode, listdir, read, scandir, strerror
+from os.path import basename, dirname, isdir, join, lexists, normpath
 from pathlib import Path
 import re
+from select  import select
 from shutil  import which
+import struct
 from sys     import argv, stderr, exit as sysexit
+from time    import monotonic
+from traceback import print_exc
 
-from tqdm import tqdm
-import yaml
+from pymkv   import enable_identify_cache, FontIndex
+from pymkv.Progress import ProgressEvent, iter_events
 
 import subbot
 
-def glob_pattern(patterns):
+# `tqdm`, `yaml` and `ctypes` are imported where they are used, so that `--help` and the runs with nothing to do do not
+# pay for them.
+
+# The flags and the event structure of Linux inotify, see inotify(7).
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_ONLYDIR     = 0x01000000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+INOTIFY_EVENT  = struct.Struct('iIII') # watch descriptor, mask, cookie, length of the name
+# Seconds waited after the last write of a file before muxing it, editors often save in several steps.
+DEBOUNCE: float = 2.0
+
+# Return a function matching a name against the glob `pattern`, compiled once.
+@lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    return re.compile(translate(pattern)).match
+
+# The files matched by the patterns of the projects, scanned once per run: every directory is listed at most once,
+# and the patterns are matched against the listings in memory, with the same results as `glob(recursive=True)`.
+class FileIndex:
+    def __init__(self):
+        self.listings = {} # directory -> list of (name, whether it is a directory)
+        self.projects = {} # (project, kind) -> list of files
+
+    def listing(self, directory):
+        if directory not in self.listings:
+            entries = []
+            try:
+                with scandir(directory or '.') as iterator:
+                    for entry in iterator:
+                        try:
+                            entries.append((entry.name, entry.is_dir()))
+                        except OSError:
+                            entries.append((entry.name, False))
+            except OSError:
+                pass
+            self.listings[directory] = entries
+        return self.listings[directory]
+
+    def glob(self, pattern):
+        components = pattern.split('/')
+        if components[0] == '': # absolute path
+            return list(self._glob('/', [component for component in components[1:] if component]))
+        return list(self._glob('', [component for component in components if component]))
+
+    def _glob(self, directory, components):
+        component, rest = components[0], components[1:]
+        if component == '**':
+            # Zero or more directories, hidden ones excluded.
+            if rest:
+                yield from self._glob(directory, rest)
+            for name, is_dir in self.listing(directory):
+                if name.startswith('.'):
+                    continue
+                if not rest:
+                    yield join(directory, name)
+                if is_dir:
+                    yield from self._glob(join(directory, name), components)
+        elif not has_magic(component):
+            path = join(directory, component)
+            if rest:
+                yield from self._glob(path, rest)
+            elif lexists(path):
+                yield path
+        else:
+            match = compile_pattern(component)
+            for name, is_dir in self.listing(directory):
+                if name.startswith('.') and not component.startswith('.'):
+                    continue
+                if match(name) is None:
+                    continue
+                if not rest:
+                    yield join(directory, name)
+                elif is_dir:
+                    yield from self._glob(join(directory, name), rest)
+
+    # Return the `kind` files of `project`, either 'videos' or 'subtitles'.
+    def project_files(self, config, project, kind):
+        if (project, kind) not in self.projects:
+            self.projects[(project, kind)] = glob_pattern(project_patterns(config, project, kind), self)
+        return self.projects[(project, kind)]
+
+def glob_pattern(patterns, index=None):
+    index = index or FileIndex()
     matches = []
     if isinstance(patterns, str):
         patterns = [patterns,]
     for pattern in patterns:
-        matches.extend(glob(pattern, recursive=True))
+        matches.extend(index.glob(pattern))
     return matches
 
+# Return the patterns of the `kind` files of `project`, either 'videos' or 'subtitles'.
+def project_patterns(config, project, kind):
+    patterns = config['projects'][project].get(kind)
+    if patterns is None and kind == 'videos': # the name used by older projects files
+        patterns = config['projects'][project].get('video')
+    if patterns is None:
+        return []
+    if isinstance(patterns, str):
+        patterns = [patterns,]
+    return patterns
+
+# Return the directories of the fonts to attach to the muxes of `project`.
+def project_fonts(config, project):
+    fonts = config['projects'][project].get('fonts') or []
+    if isinstance(fonts, str):
+        fonts = [fonts,]
+    return fonts
+
+def project_output_path(config, project):
+    # The per-project `output_path` has precedence over the global `output_path`,
+    # the global `output_path` has precedence over the current working directory.
+    if 'output_path' in config['projects'][project]:
+        return config['projects'][project]['output_path']
+    return config.get('output_path', '')
+
+# Return the project matched by `arg` and the pattern of its files, or None if there is none.
+def resolve_arg(arg, config):
+    if arg.count('/') != 1:
+        print(f"Unrecognised '{arg}', skipping...", file=stderr)
+        return None
+
+    project_pattern, file_pattern = arg.split('/')
+    matched_projects = fnfilter(config['projects'], project_pattern)
+    if not matched_projects:
+        print(f"No project matches the pattern in '{arg}'.", file=stderr)
+        return None
+    return matched_projects[0], file_pattern
+
+# Return the files of `project` matching `file_pattern` to merge, restricted to the ones whose stem is in `stems` if
+# not None, their output directory and the directories of their fonts, or None if there is nothing to merge. The files
+# are looked up in `index`.
+def make_invocation(arg, config, project, file_pattern, stems=None, index=None):
+    index = index or FileIndex()
+    match_name = compile_pattern(file_pattern)
+    match_pattern = lambda filepath: match_name(basename(filepath)) is not None
+    args = []
+
+    videos = index.project_files(config, project, 'videos')
+    matched_videos = [video for video in videos if match_pattern(video)
+                      and (stems is None or Path(video).stem in stems)]
+    if not matched_videos:
+        print(f'No video associated to "{arg}", skipping...', file=stderr)
+        return None
+    args.extend(matched_videos)
+
+    subtitles = index.project_files(config, project, 'subtitles')
+    matched_subtitles = [subtitle for subtitle in subtitles if match_pattern(subtitle)
+                         and (stems is None or subbot.strip_properties(Path(subtitle).stem) in stems)]
+    if not matched_subtitles:
+        print(f'No subtitles associated to "{arg}", skipping...', file=stderr)
+        return None
+    args.extend(matched_subtitles)
+
+    output_dir = Path(project_output_path(config, project) or Path.cwd())
+    if not isdir(output_dir):
+        print(f"Output path '{output_dir}' of \"{arg}\" is not a directory, skipping...", file=stderr)
+        return None
+    return args, output_dir, project_fonts(config, project)
+
+# Mux the files of all the `invocations`, as returned by `make_invocation`, as a single batch: every file is identified
+# once and the muxes of all the projects are scheduled together. The fonts of the projects and of `--fonts` are
+# indexed once for all of them.
+def mux(invocations, options):
+    font_indexes = {} # directories -> index
+    batches = []
+    for args, output_dir, font_dirs in invocations:
+        font_dirs = tuple(font_dirs) + tuple(options.fonts or ())
+        if font_dirs and font_dirs not in font_indexes:
+            font_indexes[font_dirs] = FontIndex(font_dirs)
+        batches.append((args, output_dir, font_indexes.get(font_dirs)))
+    mux_queue = subbot.make_batch_mux_queue(batches, options.probe_jobs, options.strict)
+    subbot.run_mux_queue(mux_queue, Path.cwd(), options.jobs, options.device_jobs, options.incremental,
+                         options.headroom)
+
 def expand_args(args, config):
     invocations = []
+    index = FileIndex()
 
     for arg in args:
-        if arg.count('/') != 1:
-            print(f"Unrecognised '{arg}', skipping...")
+        resolved = resolve_arg(arg, config)
+        if resolved is None:
             continue
+        invocation = make_invocation(arg, config, *resolved, index=index)
+        if invocation is not None:
+            invocations.append(invocation)
 
-        project_pattern, file_pattern = arg.split('/')
-        matched_projects = fnfilter(config['projects'], project_pattern)
-        if not matched_projects:
-            print(f"No project matches the pattern in '{arg}'.")
-            continue
-        project = matched_projects[0]
-        match_pattern = lambda filepath: fnmatch(Path(filepath).name, file_pattern)
-        args = []
-
-        videos = glob_pattern(config['projects'][project]['video'])
-        matched_videos = filter(match_pattern, videos)
-        if not matched_videos:
-            print(f'No video associated to "{arg}", skipping...')
-            continue
-        args.extend(matched_videos)
+    return invocations
+
+# A minimal binding of Linux inotify, reporting the files written or moved into a set of directories.
+class Inotify:
+    def __init__(self):
+        from ctypes import CDLL, get_errno
+        from ctypes.util import find_library
+        self.libc = CDLL(find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        self.directories = {} # watch descriptor -> directory
+
+    def add_watch(self, directory, mask):
+        from ctypes import get_errno
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, fsencode(directory), mask | IN_ONLYDIR)
+        if watch_descriptor < 0:
+            raise OSError(get_errno(), strerror(get_errno()), directory)
+        self.directories[watch_descriptor] = Path(directory)
+
+    # Return the mask and the path of the events received within `timeout` seconds, forever if None.
+    def read_events(self, timeout=None):
+        if not select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            watch_descriptor, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            directory = self.directories.get(watch_descriptor)
+            if directory is not None and name:
+                events.append((mask, directory / fsdecode(name)))
+            elif mask & IN_Q_OVERFLOW:
+                events.append((mask, None))
+        return events
+
+    def close(self):
+        close(self.fd)
+
+# Return the directories in which the files matching `pattern` can appear.
+def pattern_directories(pattern):
+    directory = dirname(pattern) or '.'
+    if not has_magic(directory):
+        return [directory] if isdir(directory) else []
+    return [path for path in glob(directory, recursive=True) if isdir(path)]
 
-        subtitles = glob_pattern(config['projects'][project]['subtitles'])
-        matched_subtitles = filter(match_pattern, subtitles)
-        if not matched_subtitles:
-            print(f'No subtitles associated to "{arg}", skipping...')
+# Mux the files of the projects matched by `args` whenever they are written, `options.debounce` seconds after the last
+# write of a stem, so that a burst of saves triggers a single mux. Only the stems written are muxed.
+def watch(args, config, options):
+    watched = [] # (arg, project, file pattern, videos patterns, subtitles patterns)
+    for arg in args:
+        resolved = resolve_arg(arg, config)
+        if resolved is None:
             continue
-        args.extend(matched_subtitles)
+        project, file_pattern = resolved
+        watched.append((arg, project, file_pattern,
+                        [normpath(pattern) for pattern in project_patterns(config, project, 'videos')],
+                        [normpath(pattern) for pattern in project_patterns(config, project, 'subtitles')]))
+    if not watched:
+        return
 
-        output_path = ''
-        # The per-project `output_path` has precedence over the global `output_path`,
-        # the global `output_path` has precedence over the actual MKV path.
-        if 'output_path' in config['projects'][project]:
-            output_path = config['projects'][project]['output_path']
-        elif 'output_path' in config:
-            output_path = config['output_path']
-        args.append(output_path)
+    inotify = Inotify()
+    directories = {directory for _, _, _, videos, subtitles in watched
+                   for pattern in videos + subtitles for directory in pattern_directories(pattern)}
+    for directory in sorted(directories):
+        inotify.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO)
+    print(f'Watching {len(directories)} directories, press Ctrl+C to stop.', file=stderr)
 
-        invocations.append(args)
+    pending = {} # (index of the watched argument, stem or None for all of them) -> deadline of its mux
+    try:
+        while True:
+            timeout = max(0, min(pending.values()) - monotonic()) if pending else None
+            for mask, path in inotify.read_events(timeout):
+                for index, (_, _, file_pattern, videos, subtitles) in enumerate(watched):
+                    if path is None: # events were lost, mux everything again
+                        pending[(index, None)] = monotonic() + options.debounce
+                        continue
+                    if not fnmatch(path.name, file_pattern):
+                        continue
+                    if any(fnmatch(str(path), pattern) for pattern in videos):
+                        pending[(index, path.stem)] = monotonic() + options.debounce
+                    elif any(fnmatch(str(path), pattern) for pattern in subtitles):
+                        pending[(index, subbot.strip_properties(path.stem))] = monotonic() + options.debounce
 
-    return invocations
+            now = monotonic()
+            due = {}
+            for key, deadline in list(pending.items()):
+                if deadline <= now:
+                    del pending[key]
+                    due.setdefault(key[0], set()).add(key[1])
+            # The files are scanned again for every batch of muxes, they could have changed in the meantime.
+            file_index = FileIndex()
+            invocations = []
+            for index, stems in due.items():
+                arg, project, file_pattern, _, _ = watched[index]
+                invocation = make_invocation(arg, config, project, file_pattern, None if None in stems else stems,
+                                             file_index)
+                if invocation is not None:
+                    invocations.append(invocation)
+            if not invocations:
+                continue
+            try:
+                mux(invocations, options)
+            except Exception:
+                print_exc(file=stderr)
+            subbot.write_metrics(options.metrics_file)
+    finally:
+        inotify.close()
 
 def show_progress(process, mux_path):
+    from tqdm import tqdm
     with tqdm(range(100), mux_path, leave=False, file=stderr,
               bar_format='{l_bar}{bar}|{elapsed}') as pbar:
-        curr_percentage = 0
         last_percentage = 0
-        for line in process.stdout:
-            match = re.search('#GUI#progress (\\d+)%', line)
-            if line.startswith(('#GUI#warning', '#GUI#error')):
-                pbar.write(f'{line[5].upper()}{line[6:]}'.strip(), file=stderr)
-            if match is None:
+        for event in iter_events(process.stdout):
+            if not isinstance(event, ProgressEvent):
+                pbar.write(str(event), file=stderr)
                 continue
-            curr_percentage = int(match.group(1))
-            pbar.update(curr_percentage - last_percentage)
-            last_percentage = curr_percentage
+            pbar.update(event.percentage - last_percentage)
+            last_percentage = event.percentage
         if pbar.n == 0: # an error occurred
             pbar.clear()
 
+def parse_args(args):
+    parser = ArgumentParser(prog='subbotf', usage='%(prog)s [options] [--] proj*1/file1* ...',
+                            parents=[subbot.option_parser()])
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and mux the files of the projects whenever they are written (Linux only)')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE, metavar='SECONDS',
+                        help='with --watch, seconds waited after the last write of a file before muxing it '
+                             '(default: %(default)s)')
+    parser.add_argument('patterns', nargs='*', help='globs of a project name and of its files, e.g. proj*1/file1*')
+    return parser.parse_args(args)
+
 def main(args):
+    options = parse_args(args)
+    args = options.patterns
     if not args:
-        print('Usage: subbotf proj*1/file1* ...')
+        print('Usage: subbotf [options] [--] proj*1/file1* ...')
         return
 
     script_parent = Path(__file__).parent.absolute()
@@ -96,19 +365,31 @@ def main(args):
               file=stderr)
         sysexit(1)
 
+    import yaml
     with open(projects) as y:
         config = yaml.safe_load(y)
 
     if 'projects' not in config:
-        print(f"No project found, please add at least one in '{script_parent / 'projects.yaml'}'.")
+        print(f"No project found, please add at least one in '{script_parent / 'projects.yaml'}'.", file=stderr)
         sysexit(2)
 
-    invocations = expand_args(args, config)
     # MKVMERGE_PATH needs to be a non-empty string, otherwise subbot.verify_mkvmerge fails
     subbot.MKVMERGE_PATH = config.get('mkvmerge_path', 'mkvmerge')
     subbot.show_progress = show_progress
-    for args in invocations:
-        subbot.main(args)
+    subbot.JSON_OUTPUT = options.json
+    if which(subbot.MKVMERGE_PATH) is None:
+        print('Could not find `mkvmerge`, please add it to $PATH.', file=stderr)
+        sysexit(1)
+    enable_identify_cache()
+
+    if options.watch:
+        watch(args, config, options)
+        return
+
+    try:
+        mux(expand_args(args, config), options)
+    finally:
+        subbot.write_metrics(options.metrics_file)
 
 if __name__ == '__main__':
     subbot.handle_sigint()